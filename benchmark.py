@@ -0,0 +1,458 @@
+# Headless benchmark of the interpolation engine in scalecore.py
+#
+# Sweeps control point count, query count and weighting mode, and reports throughput,
+# latency percentiles and peak memory as JSON. Example:
+#
+#   python benchmark.py --points 10 1000 100000 --queries 1 1000 --output bench.json
+#
+# Other suites are selected with --suite:
+#
+#   incremental: cost of a single point edit with TrackedScales, against evaluating all tracked positions again
+#   approx: speed and error of the Barnes-Hut approximation against the exact batch evaluation, fails if
+#           opening angle 0.0 is not exact
+#   coherence: per-frame cost of CoherentQuery for slowly moving agents, against full evaluation every frame
+#   pointset: load time of binary point set files, against the same points as JSON, and streaming append rate
+#   startup: import time of scalecore and of the pygame front end, measured with python -X importtime
+#   draw: draw pass 1 and frame rebuild time of the pygame front end, batched against one draw call per point
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import scalecore
+
+
+# Default sweep
+DEFAULT_POINT_COUNTS = [10, 100, 1000, 10000, 100000, 1000000]
+DEFAULT_QUERY_COUNTS = [1, 100, 1000]
+DEFAULT_REPEAT = 5
+DEFAULT_MAX_PAIRS = 10 ** 8 # Batch runs above points * queries are skipped
+DEFAULT_SCALAR_MAX_PAIRS = 10 ** 6 # Scalar runs above points * queries are skipped
+DEFAULT_THETAS = [0.3, 0.5, 1.0]
+EXACT_TOLERANCE = 1e-9 # Max relative error of the approximation with opening angle 0.0, which must be exact
+DEFAULT_FRAMES = 100
+DEFAULT_STEP = 2.0
+DEFAULT_RADII = [[2, 10], [10, 150]] # Value ranges of the draw suite, the value of a point is its circle radius
+
+# Creates a control point set with uniformly distributed random points
+def make_control_points(count, rng):
+    control_points = scalecore.ControlPointSet()
+    control_points.assign_arrays(
+        rng.integers(0, scalecore.WIDTH, count),
+        rng.integers(0, scalecore.HEIGHT, count),
+        rng.integers(scalecore.DEFAULT_POINT_MIN_VALUE, scalecore.DEFAULT_POINT_MAX_VALUE + 1, count))
+    return control_points
+
+# Creates an (N, 2) array of random query positions on the screen
+def make_queries(count, rng):
+    return np.column_stack((rng.uniform(0, scalecore.WIDTH, count), rng.uniform(0, scalecore.HEIGHT, count)))
+
+# Returns a function evaluating all queries once, and a list collecting the duration of each evaluation call
+def make_run(path, mode, control_points, query_pos):
+    latencies = []
+    if path == "batch":
+        def run():
+            start = time.perf_counter()
+            scalecore.get_object_scales(control_points, query_pos, mode)
+            latencies.append(time.perf_counter() - start)
+    else:
+        function = scalecore.weighting_functions[mode]
+        positions = [tuple(pos) for pos in query_pos.tolist()]
+        def run():
+            for pos in positions:
+                start = time.perf_counter()
+                function(control_points, pos)
+                latencies.append(time.perf_counter() - start)
+    return run, latencies
+
+# Benchmarks one configuration, returns its result record
+def benchmark_case(path, mode, control_points, query_pos, repeat):
+    run, latencies = make_run(path, mode, control_points, query_pos)
+
+    # Warm up, then measure peak memory of a single run separately, as tracing slows everything down
+    run()
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del latencies[:]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "path": path,
+        "mode": scalecore.weighting_modes[mode],
+        "points": len(control_points),
+        "queries": len(query_pos),
+        "repeat": repeat,
+        "seconds": elapsed,
+        "throughput_qps": len(query_pos) * repeat / elapsed,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p90": float(np.percentile(latencies_ms, 90)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max())
+        },
+        "peak_memory_bytes": peak_memory
+    }
+
+# Benchmarks single point edits on tracked positions, returns its result record
+def benchmark_incremental(control_points, query_pos, repeat, rng):
+    tracked = scalecore.TrackedScales(control_points, query_pos)
+
+    # Each edit is an append followed by a remove of the new point, so the set stays the same size
+    def edit():
+        index = control_points.append((rng.uniform(0, scalecore.WIDTH), rng.uniform(0, scalecore.HEIGHT)), scalecore.DEFAULT_POINT_MAX_VALUE)
+        control_points.remove(index)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        edit()
+    incremental = (time.perf_counter() - start) / (2 * repeat)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for mode in tracked.modes:
+            scalecore.get_object_scales(control_points, query_pos, mode)
+    full = (time.perf_counter() - start) / repeat
+
+    max_error = max(float(np.abs(tracked.scales(mode) - scalecore.get_object_scales(control_points, query_pos, mode)).max()) for mode in tracked.modes)
+    tracked.close()
+    return {
+        "suite": "incremental",
+        "points": len(control_points),
+        "queries": len(query_pos),
+        "repeat": repeat,
+        "incremental_update_ms": incremental * 1000.0,
+        "full_recompute_ms": full * 1000.0,
+        "speedup": full / incremental,
+        "max_error": max_error
+    }
+
+# Returns the shortest duration of repeat calls of function in seconds, and the result of the last call
+def time_best(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+# Benchmarks loading a point set from a binary point set file and from JSON, returns its result record
+def benchmark_pointset(control_points, repeat, append_count=10000):
+    with tempfile.TemporaryDirectory() as directory:
+        binary_path = os.path.join(directory, "points.cps")
+        json_path = os.path.join(directory, "points.json")
+        scalecore.save_point_set(binary_path, control_points)
+        with open(json_path, "w") as f:
+            json.dump(np.column_stack((control_points.xs, control_points.ys, control_points.values)).tolist(), f)
+
+        def load_json():
+            with open(json_path) as f:
+                points = np.array(json.load(f), dtype=np.float64).reshape(-1, 3)
+            loaded = scalecore.ControlPointSet()
+            loaded.assign_arrays(points[:, 0], points[:, 1], points[:, 2])
+            return loaded
+
+        json_seconds, _ = time_best(load_json, repeat)
+        binary_seconds, loaded = time_best(lambda: scalecore.load_point_set(binary_path), repeat)
+        # Touches every page, for the cost of actually reading the mapped data
+        binary_read_seconds, _ = time_best(lambda: scalecore.load_point_set(binary_path).values.sum(), repeat)
+        identical = bool((loaded.xs == control_points.xs).all() and (loaded.ys == control_points.ys).all() and (loaded.values == control_points.values).all())
+
+        # Saving a set over the file it is mapped from, as F9 then F5 in the prototype does
+        scalecore.save_point_set(binary_path, loaded)
+        resaved = scalecore.load_point_set(binary_path)
+        round_trip = bool((resaved.xs == control_points.xs).all() and (resaved.ys == control_points.ys).all() and (resaved.values == control_points.values).all())
+        del loaded, resaved
+
+        # Single point appends, as when streaming edits
+        append_path = os.path.join(directory, "append.cps")
+        with scalecore.PointSetWriter(append_path) as writer:
+            start = time.perf_counter()
+            for i in range(append_count):
+                writer.append((float(i), float(i)), 1.0)
+            append_seconds = time.perf_counter() - start
+
+        return {
+            "suite": "pointset",
+            "points": len(control_points),
+            "repeat": repeat,
+            "binary_bytes": os.path.getsize(binary_path),
+            "json_bytes": os.path.getsize(json_path),
+            "json_load_ms": json_seconds * 1000.0,
+            "binary_load_ms": binary_seconds * 1000.0,
+            "binary_load_and_read_ms": binary_read_seconds * 1000.0,
+            "speedup": json_seconds / binary_seconds,
+            "identical": identical,
+            "identical_after_resave": round_trip,
+            "appends_per_second": append_count / append_seconds
+        }
+
+# Benchmarks the Barnes-Hut approximation of one mode, returns a result record per theta.
+# Errors are relative to the exact batch evaluation, which is skipped above max_pairs.
+def benchmark_approx(mode, control_points, query_pos, thetas, repeat, max_pairs):
+    build_seconds, _ = time_best(lambda: scalecore.PointQuadtree(control_points.xs, control_points.ys, control_points.values), 1)
+    exact = None
+    if len(control_points) * len(query_pos) <= max_pairs:
+        exact_seconds, exact = time_best(lambda: scalecore.get_object_scales(control_points, query_pos, mode), repeat)
+
+    results = []
+    for theta in thetas:
+        approx_seconds, approx = time_best(lambda: scalecore.get_object_scales_approx(control_points, query_pos, mode, theta), repeat)
+        result = {
+            "suite": "approx",
+            "mode": scalecore.weighting_modes[mode],
+            "points": len(control_points),
+            "queries": len(query_pos),
+            "theta": theta,
+            "repeat": repeat,
+            "build_ms": build_seconds * 1000.0,
+            "approx_ms": approx_seconds * 1000.0,
+            "visits_per_query": control_points.quadtree.visits / len(query_pos)
+        }
+        if exact is not None:
+            relative_error = np.abs(approx - exact) / np.maximum(np.abs(exact), 1e-12)
+            result.update({
+                "exact_ms": exact_seconds * 1000.0,
+                "speedup": exact_seconds / approx_seconds,
+                "max_relative_error": float(relative_error.max()),
+                "mean_relative_error": float(relative_error.mean())
+            })
+            if theta == 0.0:
+                result["exact"] = bool(relative_error.max() <= EXACT_TOLERANCE)
+        results.append(result)
+    return results
+
+# Benchmarks agents moving step pixels per frame in random directions for a number of frames, evaluated
+# with one CoherentQuery each and with the full evaluation. Returns its result record.
+def benchmark_coherence(mode, control_points, num_agents, frames, step, rng):
+    angles = rng.uniform(0, 2 * np.pi, (frames, num_agents))
+    paths = make_queries(num_agents, rng) + np.cumsum(step * np.stack((np.cos(angles), np.sin(angles)), axis=2), axis=0)
+    paths = [[tuple(pos) for pos in frame] for frame in paths.tolist()]
+
+    if mode == 4:
+        def full(pos):
+            return scalecore.get_object_scale_max_nearby(control_points, pos), None
+    elif mode == 2:
+        def full(pos):
+            return scalecore.get_object_scale_exponential_truncated(control_points, pos)
+    else:
+        def full(pos):
+            return scalecore.get_object_scale_gaussian_truncated(control_points, pos)
+
+    start = time.perf_counter()
+    expected = [[full(pos)[0] for pos in frame] for frame in paths]
+    full_seconds = time.perf_counter() - start
+
+    queries = [scalecore.CoherentQuery() for _ in range(num_agents)]
+    start = time.perf_counter()
+    actual = [[query.get(control_points, pos, mode)[0] for query, pos in zip(queries, frame)] for frame in paths]
+    coherent_seconds = time.perf_counter() - start
+
+    hits = sum(query.hits for query in queries)
+    return {
+        "suite": "coherence",
+        "mode": scalecore.weighting_modes[mode],
+        "points": len(control_points),
+        "agents": num_agents,
+        "frames": frames,
+        "step": step,
+        "full_ms_per_frame": full_seconds * 1000.0 / frames,
+        "coherent_ms_per_frame": coherent_seconds * 1000.0 / frames,
+        "speedup": full_seconds / coherent_seconds,
+        "hit_rate": hits / (num_agents * frames),
+        "max_error": float(np.abs(np.array(actual) - np.array(expected)).max())
+    }
+
+# Imports a module in a fresh interpreter with -X importtime, returns {module: cumulative import time in ms}
+def measure_import_times(module):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1000.0
+    return times
+
+# Benchmarks the startup cost of importing a module, returns its result record. NumPy is imported
+# by scalecore, its share is reported separately, as no amount of deferring in this repo can avoid it.
+def benchmark_startup(module, repeat):
+    runs = [measure_import_times(module) for _ in range(repeat + 1)][1:] # The first run may compile .pyc files
+    total = min(run[module] for run in runs)
+    numpy = min(run.get("numpy", 0.0) for run in runs)
+    pygame = min(run.get("pygame", 0.0) for run in runs)
+    return {
+        "suite": "startup",
+        "module": module,
+        "repeat": repeat,
+        "import_ms": total,
+        "numpy_import_ms": numpy,
+        "pygame_import_ms": pygame,
+        "import_ms_without_numpy": total - numpy,
+        "imports_pygame": all("pygame" in run for run in runs)
+    }
+
+# Opens a hidden pygame window and returns the front end module, which is only imported by the draw suite
+def init_front_end():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    import scaletest
+    pygame.init()
+    pygame.display.set_mode((scalecore.WIDTH, scalecore.HEIGHT))
+    scaletest.font = pygame.font.Font(None, scaletest.FONT_SIZE)
+    return scaletest
+
+# Benchmarks draw pass 1 and a full rebuild of the cached layers with and without DRAW_BATCHED, returns its result record
+def benchmark_draw(front_end, control_points, radii, repeat):
+    import pygame
+    renderer = front_end.Renderer((scalecore.WIDTH, scalecore.HEIGHT))
+    control_points.update_aggregates()
+    timings = {}
+    layers = {}
+    for batched in (False, True):
+        front_end.DRAW_BATCHED = batched
+        def pass1():
+            renderer.base_layer.fill(front_end.BACKGROUND)
+            if batched:
+                front_end.draw_control_points_pass1_batched(renderer.base_layer, control_points)
+            else:
+                front_end.draw_control_points_pass1(renderer.base_layer, control_points)
+        pass1() # Warm up the disc offsets cache
+        timings[batched] = (time_best(pass1, repeat)[0], time_best(lambda: renderer.rebuild_layers(control_points), repeat)[0])
+        layers[batched] = pygame.surfarray.array2d(renderer.base_layer)
+    return {
+        "suite": "draw",
+        "points": len(control_points),
+        "radii": radii,
+        "per_call_pass1_ms": timings[False][0] * 1000.0,
+        "batched_pass1_ms": timings[True][0] * 1000.0,
+        "per_call_frame_ms": timings[False][1] * 1000.0,
+        "batched_frame_ms": timings[True][1] * 1000.0,
+        "speedup": timings[False][0] / timings[True][0],
+        "mismatched_pixels": int(np.count_nonzero(layers[False] != layers[True]))
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Headless benchmark of the interpolation engine")
+    parser.add_argument("--points", type=int, nargs="+", default=DEFAULT_POINT_COUNTS, help="control point counts to sweep")
+    parser.add_argument("--queries", type=int, nargs="+", default=DEFAULT_QUERY_COUNTS, help="query counts to sweep")
+    parser.add_argument("--modes", type=int, nargs="+", default=list(range(len(scalecore.weighting_modes))), help="weighting mode indices to sweep")
+    parser.add_argument("--paths", nargs="+", choices=["batch", "scalar"], default=["batch", "scalar"], help="evaluation paths to sweep")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per configuration")
+    parser.add_argument("--max-pairs", type=int, default=DEFAULT_MAX_PAIRS, help="skip batch runs with more points * queries")
+    parser.add_argument("--scalar-max-pairs", type=int, default=DEFAULT_SCALAR_MAX_PAIRS, help="skip scalar runs with more points * queries")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for points and queries")
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES, help="frames for the coherence suite")
+    parser.add_argument("--step", type=float, default=DEFAULT_STEP, help="pixels agents move per frame in the coherence suite")
+    parser.add_argument("--thetas", type=float, nargs="+", default=DEFAULT_THETAS, help="opening angles for the approx suite")
+    parser.add_argument("--radii", type=int, nargs=2, action="append", metavar=("MIN", "MAX"), help="point value range for the draw suite, can be repeated")
+    parser.add_argument("--suite", choices=["modes", "incremental", "approx", "coherence", "pointset", "startup", "draw"], default="modes", help="benchmark suite to run")
+    parser.add_argument("--output", help="write JSON to this file instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+
+    results = []
+    if args.suite == "startup":
+        for module in ["scalecore", "scaletest"]:
+            result = benchmark_startup(module, args.repeat)
+            results.append(result)
+            print(f"startup {module:10} {result['import_ms']:8.2f} ms, {result['import_ms_without_numpy']:8.2f} ms without numpy, pygame imported: {result['imports_pygame']}", file=sys.stderr)
+    if args.suite == "draw":
+        front_end = init_front_end()
+        for num_points in args.points:
+            for min_value, max_value in args.radii or DEFAULT_RADII:
+                control_points = scalecore.ControlPointSet()
+                control_points.assign_arrays(
+                    rng.integers(0, scalecore.WIDTH, num_points),
+                    rng.integers(0, scalecore.HEIGHT, num_points),
+                    rng.integers(min_value, max_value + 1, num_points))
+                result = benchmark_draw(front_end, control_points, [min_value, max_value], args.repeat)
+                results.append(result)
+                print(f"draw points={num_points:<8} radii={min_value}-{max_value:<5} pass1 {result['per_call_pass1_ms']:8.2f} ms per call, {result['batched_pass1_ms']:8.2f} ms batched ({result['speedup']:.1f}x), frame {result['per_call_frame_ms']:8.2f} ms / {result['batched_frame_ms']:8.2f} ms, {result['mismatched_pixels']} mismatched pixels", file=sys.stderr)
+    for num_points in args.points if args.suite not in ("startup", "draw") else []:
+        control_points = make_control_points(num_points, rng)
+        if args.suite == "pointset":
+            result = benchmark_pointset(control_points, args.repeat)
+            results.append(result)
+            print(f"pointset points={num_points:<8} json {result['json_load_ms']:10.2f} ms, binary {result['binary_load_ms']:8.3f} ms ({result['binary_load_and_read_ms']:8.2f} ms with reading), {result['appends_per_second']:10.0f} appends/s", file=sys.stderr)
+            continue
+        for num_queries in args.queries:
+            query_pos = make_queries(num_queries, rng)
+            if args.suite == "coherence":
+                for mode in args.modes:
+                    if mode not in scalecore.COHERENT_MODES:
+                        continue
+                    result = benchmark_coherence(mode, control_points, num_queries, args.frames, args.step, rng)
+                    results.append(result)
+                    print(f"coherence {result['mode']:22} points={num_points:<8} agents={num_queries:<6} {result['coherent_ms_per_frame']:10.3f} ms/frame, {result['speedup']:8.1f}x faster than full, hit rate {result['hit_rate']:.2f}", file=sys.stderr)
+                continue
+            if args.suite == "approx":
+                for mode in args.modes:
+                    if mode not in scalecore.APPROX_MODES:
+                        continue
+                    for result in benchmark_approx(mode, control_points, query_pos, args.thetas, args.repeat, args.max_pairs):
+                        results.append(result)
+                        error = f"max error {result['max_relative_error']:.2e}" if "max_relative_error" in result else "exact skipped"
+                        print(f"approx {result['mode']:22} points={num_points:<8} queries={num_queries:<6} theta={result['theta']:<4} {result['approx_ms']:10.2f} ms, {error}", file=sys.stderr)
+                continue
+            if args.suite == "incremental":
+                if num_points * num_queries > args.max_pairs:
+                    continue
+                result = benchmark_incremental(control_points, query_pos, args.repeat, rng)
+                results.append(result)
+                print(f"incremental points={num_points:<8} queries={num_queries:<6} {result['incremental_update_ms']:10.3f} ms per edit, {result['speedup']:10.1f}x faster than full", file=sys.stderr)
+                continue
+            for path in args.paths:
+                max_pairs = args.max_pairs if path == "batch" else args.scalar_max_pairs
+                for mode in args.modes:
+                    if num_points * num_queries > max_pairs:
+                        results.append({"path": path, "mode": scalecore.weighting_modes[mode], "points": num_points, "queries": num_queries, "skipped": True})
+                        continue
+                    result = benchmark_case(path, mode, control_points, query_pos, args.repeat)
+                    results.append(result)
+                    print(f"{path:6} {result['mode']:22} points={num_points:<8} queries={num_queries:<6} {result['throughput_qps']:14.1f} queries/s", file=sys.stderr)
+
+    report = {
+        "environment": {
+            "prototype_version": scalecore.PROTOTYPE_VERSION,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform()
+        },
+        "config": vars(args),
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    # Fail validation runs, e.g. of the approximation with opening angle 0.0
+    failed = [result for result in results if result.get("exact") is False]
+    if failed:
+        for result in failed:
+            print(f"FAILED: {result['suite']} {result['mode']} points={result['points']} theta={result['theta']} is not exact, max relative error {result['max_relative_error']:.2e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
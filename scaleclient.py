@@ -0,0 +1,127 @@
+# Load generator for scaleserver.py
+#
+# Opens several connections, each keeping up to --pipeline query requests in flight, and reports
+# requests/s, positions/s and latency percentiles as JSON. With --local, a server is started in
+# the same process first, so the whole round trip can be tested on localhost. Example:
+#
+#   python scaleclient.py --local --points 1000 --connections 4 --requests 500 --batch 100
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+import scalecore
+import scaleserver
+
+
+# Opens a connection to the server
+async def connect(args):
+    if args.unix is not None:
+        return await asyncio.open_unix_connection(args.unix, limit=scaleserver.MAX_LINE_LENGTH)
+    return await asyncio.open_connection(args.host, args.port, limit=scaleserver.MAX_LINE_LENGTH)
+
+# Sends one request and waits for its response
+async def request(reader, writer, message):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
+
+# Sends num_requests pipelined queries over one connection, returns the latency of each in seconds
+async def run_connection(args, rng):
+    reader, writer = await connect(args)
+    in_flight = asyncio.Semaphore(args.pipeline)
+    send_times = {}
+    latencies = []
+
+    async def send():
+        for request_id in range(args.requests):
+            await in_flight.acquire()
+            positions = np.column_stack((rng.uniform(0, scalecore.WIDTH, args.batch), rng.uniform(0, scalecore.HEIGHT, args.batch)))
+            message = {"id": request_id, "op": "query", "mode": args.mode, "positions": positions.tolist()}
+            send_times[request_id] = time.perf_counter()
+            writer.write(json.dumps(message).encode() + b"\n")
+            await writer.drain()
+
+    async def receive():
+        for _ in range(args.requests):
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - send_times.pop(response["id"]))
+            if "error" in response:
+                raise RuntimeError(response["error"])
+            in_flight.release()
+
+    await asyncio.gather(send(), receive())
+    writer.close()
+    return latencies
+
+async def run(args):
+    server = None
+    if args.local:
+        server = await scaleserver.ScaleServer().start(args.host, args.port, args.unix)
+
+    try:
+        # Upload a random point set
+        if args.points is not None:
+            rng = np.random.default_rng(args.seed)
+            points = np.column_stack((
+                rng.integers(0, scalecore.WIDTH, args.points),
+                rng.integers(0, scalecore.HEIGHT, args.points),
+                rng.integers(scalecore.DEFAULT_POINT_MIN_VALUE, scalecore.DEFAULT_POINT_MAX_VALUE + 1, args.points)))
+            reader, writer = await connect(args)
+            await request(reader, writer, {"id": 0, "op": "set_points", "points": points.tolist()})
+            writer.close()
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run_connection(args, np.random.default_rng(args.seed + 1 + i)) for i in range(args.connections)))
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+    latencies_ms = np.concatenate([np.array(r) for r in results]) * 1000.0
+    num_requests = args.connections * args.requests
+    return {
+        "config": vars(args),
+        "seconds": elapsed,
+        "requests_per_second": num_requests / elapsed,
+        "positions_per_second": num_requests * args.batch / elapsed,
+        "latency_ms": {
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p90": float(np.percentile(latencies_ms, 90)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "p999": float(np.percentile(latencies_ms, 99.9)),
+            "max": float(latencies_ms.max())
+        }
+    }
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load generator for the scale query server")
+    parser.add_argument("--host", default=scaleserver.DEFAULT_HOST, help="server TCP host")
+    parser.add_argument("--port", type=int, default=scaleserver.DEFAULT_PORT, help="server TCP port")
+    parser.add_argument("--unix", metavar="PATH", help="connect to this Unix socket instead of TCP")
+    parser.add_argument("--local", action="store_true", help="start a server in this process")
+    parser.add_argument("--points", type=int, help="upload this many random control points before the run")
+    parser.add_argument("--mode", type=int, default=0, help="weighting mode index")
+    parser.add_argument("--connections", type=int, default=4, help="number of concurrent connections")
+    parser.add_argument("--requests", type=int, default=500, help="query requests per connection")
+    parser.add_argument("--batch", type=int, default=100, help="positions per query request")
+    parser.add_argument("--pipeline", type=int, default=16, help="max requests in flight per connection")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for points and positions")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    report = asyncio.run(run(parse_args(argv)))
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1336 @@
+# Interpolation core of the prototype
+#
+# Control point storage, spatial index and all weighting modes, in scalar, batch, incremental,
+# baked and truncated variants. Only depends on NumPy, so tools that don't need a window
+# (benchmark.py, tilebake.py, scaleserver.py) can import it without loading pygame.
+
+import math
+import os
+import random
+from collections import OrderedDict
+import numpy as np
+
+
+PROTOTYPE_VERSION = 0.3
+
+# Settings
+WIDTH, HEIGHT = 1280, 720 # Screen dimensions
+DEFAULT_POINT_MIN_VALUE = 10 # Minimum value for random points
+DEFAULT_POINT_MAX_VALUE = 150 # Maximum value for random points
+DEFAULT_POINT_VALUE = 50 # Default point value for manually added points
+INITIAL_NUM_POINTS = 5 # Number of initial points
+SPATIAL_GRID_CELL_SIZE = 32 # Cell size of the spatial index over control points
+EXPONENTIAL_DECAY_FACTOR = 0.05 # Decay factor of the Exponential Decay weighting
+GAUSSIAN_SIGMA = 100 # Standard deviation of the Gaussian weighting
+EXPONENTIAL_CUTOFF_RADIUS = 300 # Points further away are skipped by truncated Exponential Decay (weight < 3.1e-7)
+GAUSSIAN_CUTOFF_RADIUS = 500 # Points further away are skipped by truncated Gaussian Weighting (weight < 3.8e-6)
+LOOKUP_TEXTURE_CELL_SIZE = 8 # Distance between samples of the baked scale lookup texture
+LOOKUP_TEXTURE_ERROR_SAMPLES = 8 # Random positions per cell, besides its center, at which the error of the lookup texture is measured
+SCALE_CACHE_SIZE = 4096 # Maximum number of memoized scale results
+SCALE_CACHE_QUANTUM = 1.0 # Query positions are snapped to a grid of this size before memoizing
+COHERENCE_MARGIN = 16 # Distance a coherent query may move before its candidate points are searched again
+QUADTREE_LEAF_SIZE = 16 # Quadtree nodes with more points are split
+QUADTREE_THETA = 0.5 # Opening angle of the Barnes-Hut approximation, 0.0 is exact
+QUADTREE_QUERY_CHUNK = 4096 # Number of queries traversing the quadtree at once, bounds temporary memory
+
+# Weighting modes
+weighting_modes = [
+    "Inverse Linear",
+    "Inverse Square",
+    "Exponential Decay",
+    "Gaussian Weighting",
+    "Max-Nearby Influence",
+    "Weighted Median",
+    "Harmonic Mean"
+]
+
+# Generate random control points
+def generate_random_point(width, height, scale_min, scale_max):
+    x = random.randint(0, width - 1)
+    y = random.randint(0, height - 1)
+    scale_value = random.randint(scale_min, scale_max)
+    return (x, y), scale_value
+
+# Function to compute distance
+def distance(point1, point2):
+    dx = point1[0] - point2[0]
+    dy = point1[1] - point2[1]
+    return math.sqrt(dx ** 2 + dy ** 2)
+
+# Uniform grid over control point indices, for k-nearest and radius queries that only visit nearby cells.
+# Each cell holds (index, x, y) entries. Owned and kept in sync by ControlPointSet.
+class SpatialGrid:
+    def __init__(self, cell_size=SPATIAL_GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.rebuild((), ())
+
+    # Returns the (column, row) of the cell containing a position
+    def cell_of(self, pos):
+        return (int(pos[0] // self.cell_size), int(pos[1] // self.cell_size))
+
+    # Removes all entries and inserts points 0 .. len(xs) - 1
+    def rebuild(self, xs, ys):
+        self.cells = {}
+        self.bounds = None # (min column, min row, max column, max row) of all cells ever occupied
+        for index, (x, y) in enumerate(zip(xs, ys)):
+            self.add(index, (x, y))
+
+    def add(self, index, pos):
+        cell = self.cell_of(pos)
+        self.cells.setdefault(cell, []).append((index, pos[0], pos[1]))
+        if self.bounds is None:
+            self.bounds = (cell[0], cell[1], cell[0], cell[1])
+        else:
+            min_col, min_row, max_col, max_row = self.bounds
+            self.bounds = (min(min_col, cell[0]), min(min_row, cell[1]), max(max_col, cell[0]), max(max_row, cell[1]))
+
+    def remove(self, index, pos):
+        cell = self.cell_of(pos)
+        bucket = self.cells[cell]
+        for i, entry in enumerate(bucket):
+            if entry[0] == index:
+                del bucket[i]
+                break
+        if not bucket:
+            del self.cells[cell]
+
+    # Renumbers the point at pos from old_index to new_index
+    def move(self, old_index, new_index, pos):
+        bucket = self.cells[self.cell_of(pos)]
+        for i, entry in enumerate(bucket):
+            if entry[0] == old_index:
+                bucket[i] = (new_index, entry[1], entry[2])
+                break
+
+    # Yields the cells at Chebyshev distance ring from the given cell
+    @staticmethod
+    def ring_cells(col, row, ring):
+        if ring == 0:
+            yield (col, row)
+            return
+        for d in range(-ring, ring + 1):
+            yield (col + d, row - ring)
+            yield (col + d, row + ring)
+        for d in range(-ring + 1, ring):
+            yield (col - ring, row + d)
+            yield (col + ring, row + d)
+
+    # Returns the indices of all points within radius of pos
+    def query_radius(self, pos, radius):
+        min_col, min_row = self.cell_of((pos[0] - radius, pos[1] - radius))
+        max_col, max_row = self.cell_of((pos[0] + radius, pos[1] + radius))
+        result = []
+        for col in range(min_col, max_col + 1):
+            for row in range(min_row, max_row + 1):
+                for index, x, y in self.cells.get((col, row), ()):
+                    if distance((x, y), pos) <= radius:
+                        result.append(index)
+        return result
+
+    # Returns the indices of all points in cells overlapping the square around pos, a superset of query_radius()
+    def candidates(self, pos, radius):
+        min_col, min_row = self.cell_of((pos[0] - radius, pos[1] - radius))
+        max_col, max_row = self.cell_of((pos[0] + radius, pos[1] + radius))
+        result = []
+        for col in range(min_col, max_col + 1):
+            for row in range(min_row, max_row + 1):
+                bucket = self.cells.get((col, row))
+                if bucket:
+                    result.extend(entry[0] for entry in bucket)
+        return result
+
+    # Returns a list of (distance, index) for the k points nearest to pos, sorted by distance.
+    # Distance ties are broken by point index, like the batch evaluation does.
+    def nearest(self, pos, k=1):
+        if self.bounds is None:
+            return []
+        col, row = self.cell_of(pos)
+        min_col, min_row, max_col, max_row = self.bounds
+        max_ring = max(col - min_col, max_col - col, row - min_row, max_row - row, 0)
+
+        candidates = []
+        for ring in range(max_ring + 1):
+            for cell in self.ring_cells(col, row, ring):
+                for index, x, y in self.cells.get(cell, ()):
+                    candidates.append((distance((x, y), pos), index))
+            # Points in cells beyond this ring are at least ring * cell_size away, and could win a tie at exactly that distance
+            if len(candidates) >= k:
+                candidates.sort()
+                del candidates[k:]
+                if candidates[-1][0] < ring * self.cell_size:
+                    break
+        candidates.sort()
+        return candidates[:k]
+
+# Set of control points, stored as contiguous x, y and value arrays (struct of arrays).
+# Appending is amortized O(1), removing is O(1) by moving the last point into the freed slot,
+# so indices of other points may change on remove(). Keeps a SpatialGrid over the points, which is
+# built on first use, and caches min/max value and the sorted-by-value order until the next change.
+# Listeners are notified of each change after it happened, by calling their methods
+# point_added(index), point_removed(pos, value), point_changed(index, old_value) and points_reset().
+class ControlPointSet:
+    def __init__(self, points=(), capacity=16):
+        self.count = 0
+        self._xs = np.empty(capacity, dtype=np.float64)
+        self._ys = np.empty(capacity, dtype=np.float64)
+        self._values = np.empty(capacity, dtype=np.float64)
+        self._grid = None
+        self.version = 0 # Incremented on every change
+        self.listeners = []
+        self._range_version = -1
+        self._sorted_order_version = -1
+        self._sorted_arrays_version = -1
+        self._quadtree_version = -1
+        self.assign(points)
+
+    def __len__(self):
+        return self.count
+
+    # Yields ((x, y), value) for each point
+    def __iter__(self):
+        return zip(zip(self.xs.tolist(), self.ys.tolist()), self.values.tolist())
+
+    # Views of the point data, only valid until the next change
+    @property
+    def xs(self):
+        return self._xs[:self.count]
+
+    @property
+    def ys(self):
+        return self._ys[:self.count]
+
+    @property
+    def values(self):
+        return self._values[:self.count]
+
+    # Spatial index over the points, built when first used after the points were replaced
+    @property
+    def grid(self):
+        if self._grid is None:
+            self._grid = SpatialGrid()
+            self._grid.rebuild(self.xs.tolist(), self.ys.tolist())
+        return self._grid
+
+    # Barnes-Hut quadtree over the points, rebuilt when first used after a change
+    @property
+    def quadtree(self):
+        if self._quadtree_version != self.version:
+            self._quadtree = PointQuadtree(self.xs, self.ys, self.values)
+            self._quadtree_version = self.version
+        return self._quadtree
+
+    def pos(self, index):
+        return (self._xs[index].item(), self._ys[index].item())
+
+    def value(self, index):
+        return self._values[index].item()
+
+    def _changed(self):
+        self.version += 1
+
+    def _reserve(self, capacity):
+        if capacity <= len(self._xs):
+            return
+        capacity = max(capacity, 2 * len(self._xs))
+        for name in ("_xs", "_ys", "_values"):
+            buffer = np.empty(capacity, dtype=np.float64)
+            buffer[:self.count] = getattr(self, name)[:self.count]
+            setattr(self, name, buffer)
+
+    # Adds a point, returns its index
+    def append(self, pos, value):
+        self._reserve(self.count + 1)
+        index = self.count
+        self._xs[index] = pos[0]
+        self._ys[index] = pos[1]
+        self._values[index] = value
+        self.count += 1
+        if self._grid is not None:
+            self._grid.add(index, pos)
+        self._changed()
+        for listener in self.listeners:
+            listener.point_added(index)
+        return index
+
+    # Removes the point at index by moving the last point into its slot
+    def remove(self, index):
+        last = self.count - 1
+        pos = self.pos(index)
+        value = self.value(index)
+        if self._grid is not None:
+            self._grid.remove(index, pos)
+        if index != last:
+            if self._grid is not None:
+                self._grid.move(last, index, self.pos(last))
+            self._xs[index] = self._xs[last]
+            self._ys[index] = self._ys[last]
+            self._values[index] = self._values[last]
+        self.count -= 1
+        self._changed()
+        for listener in self.listeners:
+            listener.point_removed(pos, value)
+
+    # Removes the last added point
+    def pop(self):
+        self.remove(self.count - 1)
+
+    def set_value(self, index, value):
+        old_value = self.value(index)
+        self._values[index] = value
+        self._changed()
+        for listener in self.listeners:
+            listener.point_changed(index, old_value)
+
+    # Replaces all points with the given ((x, y), value) pairs
+    def assign(self, points):
+        points = list(points)
+        self.assign_arrays([pos[0] for pos, _ in points], [pos[1] for pos, _ in points], [value for _, value in points])
+
+    # Replaces all points with the given coordinate and value arrays
+    def assign_arrays(self, xs, ys, values):
+        count = len(values)
+        self.count = 0
+        self._reserve(count)
+        self._xs[:count] = xs
+        self._ys[:count] = ys
+        self._values[:count] = values
+        self.count = count
+        self._grid = None
+        self._changed()
+        for listener in self.listeners:
+            listener.points_reset()
+
+    # Replaces all points with the first count entries of the given arrays, which are used as storage
+    # without copying, e.g. memory-mapped from a file. The arrays must have the same length.
+    def adopt_arrays(self, xs, ys, values, count):
+        self._xs = xs
+        self._ys = ys
+        self._values = values
+        self.count = count
+        self._grid = None
+        self._changed()
+        for listener in self.listeners:
+            listener.points_reset()
+
+    # Computes all cached aggregates now, if the points changed since they were last computed.
+    # Each aggregate is also computed on its own when first used after a change.
+    def update_aggregates(self):
+        self._update_range()
+        self._update_sorted_arrays()
+
+    def _update_range(self):
+        if self._range_version == self.version:
+            return
+        values = self.values
+        self._min_value = values.min().item() if self.count else 0.0
+        self._max_value = values.max().item() if self.count else 0.0
+        self._range_version = self.version
+
+    def _update_sorted_order(self):
+        if self._sorted_order_version == self.version:
+            return
+        self._sorted_order = np.argsort(self.values, kind="stable")
+        self._sorted_order_version = self.version
+
+    def _update_sorted_arrays(self):
+        if self._sorted_arrays_version == self.version:
+            return
+        order = self.sorted_order
+        self._sorted_arrays = (self.xs[order], self.ys[order], self.values[order])
+        self._sorted_arrays_version = self.version
+
+    @property
+    def min_value(self):
+        self._update_range()
+        return self._min_value
+
+    @property
+    def max_value(self):
+        self._update_range()
+        return self._max_value
+
+    # Point indices sorted by value in ascending order
+    @property
+    def sorted_order(self):
+        self._update_sorted_order()
+        return self._sorted_order
+
+    # Contiguous (xs, ys, values) arrays, sorted by value in ascending order
+    @property
+    def sorted_arrays(self):
+        self._update_sorted_arrays()
+        return self._sorted_arrays
+
+# Inverse Linear
+def get_object_scale_linear(control_points, object_pos):
+    epsilon = 1e-8
+    weighted_sum = 0.0
+    total_weight = 0.0
+
+    for pos, value in control_points:
+        dist = distance(pos, object_pos)
+        weight = 1.0 / (dist + epsilon)
+
+        weighted_sum += weight * value
+        total_weight += weight
+
+    return (weighted_sum / total_weight) if total_weight > epsilon else 0.0
+
+# Inverse Square
+def get_object_scale_inverse_square(control_points, object_pos):
+    epsilon = 1e-8
+    weighted_sum = 0.0
+    total_weight = 0.0
+
+    for pos, value in control_points:
+        dist = distance(pos, object_pos)
+        weight = 1.0 / ((dist ** 2) + epsilon)
+
+        weighted_sum += weight * value
+        total_weight += weight
+
+    return (weighted_sum / total_weight) if total_weight > epsilon else 0.0
+
+# Exponential Decay
+def get_object_scale_exponential(control_points, object_pos):
+    epsilon = 1e-8
+    decay_factor = EXPONENTIAL_DECAY_FACTOR
+    weighted_sum = 0.0
+    total_weight = 0.0
+
+    for pos, value in control_points:
+        dist = distance(pos, object_pos)
+        weight = math.exp(-dist * decay_factor)
+
+        weighted_sum += weight * value
+        total_weight += weight
+
+    return (weighted_sum / total_weight) if total_weight > epsilon else control_points.values.mean()
+
+# Gaussian Weighting
+def get_object_scale_gaussian(control_points, object_pos):
+    epsilon = 1e-8
+    sigma = GAUSSIAN_SIGMA
+    weighted_sum = 0.0
+    total_weight = 0.0
+
+    for pos, value in control_points:
+        dist = distance(pos, object_pos)
+        weight = math.exp(-((dist ** 2) / (2 * (sigma ** 2))))
+
+        weighted_sum += weight * value
+        total_weight += weight
+
+    return (weighted_sum / total_weight) if total_weight > epsilon else control_points.values.mean()
+
+# Max-Nearby Influence
+# Uses the spatial grid of control_points, so only the cells around object_pos are visited.
+def get_object_scale_max_nearby(control_points, object_pos, k=3):
+    epsilon = 1e-8
+    distances = [
+        (dist, control_points.value(index))
+        for dist, index in control_points.grid.nearest(object_pos, k)
+    ]
+
+    weighted_sum = 0.0
+    total_weight = 0.0
+
+    for dist, scale in distances:
+        weight = 1.0 / (dist + epsilon)
+        weighted_sum += weight * scale
+        total_weight += weight
+
+    return (weighted_sum / total_weight) if total_weight > epsilon else 0.0
+
+# Weighted Median
+# Values don't change between queries, so the points sorted by value are cached by control_points
+# and only the weights are computed here. The median is found by bisecting the cumulative weights.
+def get_object_scale_weighted_median(control_points, object_pos):
+    epsilon = 1e-8
+    if len(control_points) == 0:
+        return 0.0
+
+    xs, ys, values = control_points.sorted_arrays
+    dx = xs - object_pos[0]
+    dy = ys - object_pos[1]
+    cumulative_weight = np.cumsum(1.0 / (np.sqrt(dx * dx + dy * dy) + epsilon))
+    total_weight = cumulative_weight[-1]
+
+    # First point at which the cumulative weight reaches half of the total weight
+    median_index = np.searchsorted(cumulative_weight, total_weight / 2)
+    return values[median_index].item()
+
+# Harmonic Mean
+def get_object_scale_harmonic_mean(control_points, object_pos):
+    epsilon = 1e-8
+    weighted_inverse = 0.0
+    total_weight = 0.0
+
+    for pos, value in control_points:
+        dist = distance(pos, object_pos)
+        weight = 1.0 / (dist + epsilon)
+
+        weighted_inverse += weight / value
+        total_weight += weight
+
+    return (total_weight / weighted_inverse) if weighted_inverse > epsilon else control_points.values.mean()
+
+# Evaluation functions, in the same order as weighting_modes
+weighting_functions = [
+    get_object_scale_linear,
+    get_object_scale_inverse_square,
+    get_object_scale_exponential,
+    get_object_scale_gaussian,
+    get_object_scale_max_nearby,
+    get_object_scale_weighted_median,
+    get_object_scale_harmonic_mean
+]
+
+# Evaluates the scale at object_pos, using the given weighting mode
+def get_object_scale(control_points, object_pos, mode):
+    return weighting_functions[mode](control_points, object_pos)
+
+# Memoizes scale results per weighting mode and query position, snapped to a grid of quantum size.
+# Least recently used results are evicted beyond max_size. All results are dropped as soon as the
+# control point set changes, which is detected by its version counter.
+class ScaleCache:
+    def __init__(self, max_size=SCALE_CACHE_SIZE, quantum=SCALE_CACHE_QUANTUM):
+        self.max_size = max_size
+        self.quantum = quantum
+        self.results = OrderedDict()
+        self.key = None # Identity and version of the control point set the results belong to
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # Returns the scale at object_pos, snapped to the quantization grid
+    def get(self, control_points, object_pos, mode):
+        key = (id(control_points), control_points.version)
+        if key != self.key:
+            if self.results:
+                self.invalidations += 1
+            self.results.clear()
+            self.key = key
+
+        column = round(object_pos[0] / self.quantum)
+        row = round(object_pos[1] / self.quantum)
+        result_key = (mode, column, row)
+        result = self.results.get(result_key)
+        if result is not None:
+            self.results.move_to_end(result_key)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        result = get_object_scale(control_points, (column * self.quantum, row * self.quantum), mode)
+        self.results[result_key] = result
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+        return result
+
+# Batch evaluation
+#
+# The get_object_scales_* functions below evaluate many query positions in one call.
+# Control point data is passed as contiguous NumPy arrays (see ControlPointSet),
+# query positions as an (N, 2) array. Each function returns an (N,) array of scale values
+# that matches the corresponding get_object_scale_* function within float tolerance.
+
+# Maximum number of (query, point) pairs evaluated at once, bounds temporary memory
+BATCH_MAX_PAIRS = 1 << 20
+
+# Yields slices over the query positions, so that each chunk stays below BATCH_MAX_PAIRS
+def batch_chunks(num_queries, num_points):
+    chunk_size = max(1, BATCH_MAX_PAIRS // max(1, num_points))
+    for start in range(0, num_queries, chunk_size):
+        yield slice(start, min(start + chunk_size, num_queries))
+
+# Computes the (chunk, points) distance matrix for a chunk of query positions
+def batch_distances(xs, ys, query_pos):
+    dx = xs[np.newaxis, :] - query_pos[:, 0, np.newaxis]
+    dy = ys[np.newaxis, :] - query_pos[:, 1, np.newaxis]
+    return np.sqrt(dx * dx + dy * dy)
+
+# Shared implementation for all modes computing weighted_sum / total_weight
+def batch_weighted_mean(xs, ys, values, query_pos, weight_function, fallback_to_mean):
+    epsilon = 1e-8
+    query_pos = np.asarray(query_pos, dtype=np.float64).reshape(-1, 2)
+    result = np.zeros(len(query_pos), dtype=np.float64)
+    if len(values) == 0:
+        return result
+
+    fallback = values.mean() if fallback_to_mean else 0.0
+    for chunk in batch_chunks(len(query_pos), len(values)):
+        weights = weight_function(batch_distances(xs, ys, query_pos[chunk]))
+        weighted_sum = weights @ values
+        total_weight = weights.sum(axis=1)
+        valid = total_weight > epsilon
+        result[chunk] = np.where(valid, weighted_sum / np.where(valid, total_weight, 1.0), fallback)
+    return result
+
+# Inverse Linear (batch)
+def get_object_scales_linear(xs, ys, values, query_pos):
+    epsilon = 1e-8
+    return batch_weighted_mean(xs, ys, values, query_pos, lambda dist: 1.0 / (dist + epsilon), False)
+
+# Inverse Square (batch)
+def get_object_scales_inverse_square(xs, ys, values, query_pos):
+    epsilon = 1e-8
+    return batch_weighted_mean(xs, ys, values, query_pos, lambda dist: 1.0 / ((dist ** 2) + epsilon), False)
+
+# Exponential Decay (batch)
+def get_object_scales_exponential(xs, ys, values, query_pos):
+    decay_factor = EXPONENTIAL_DECAY_FACTOR
+    return batch_weighted_mean(xs, ys, values, query_pos, lambda dist: np.exp(-dist * decay_factor), True)
+
+# Gaussian Weighting (batch)
+def get_object_scales_gaussian(xs, ys, values, query_pos):
+    sigma = GAUSSIAN_SIGMA
+    return batch_weighted_mean(xs, ys, values, query_pos, lambda dist: np.exp(-((dist ** 2) / (2 * (sigma ** 2)))), True)
+
+# Max-Nearby Influence (batch)
+def get_object_scales_max_nearby(xs, ys, values, query_pos, k=3):
+    epsilon = 1e-8
+    query_pos = np.asarray(query_pos, dtype=np.float64).reshape(-1, 2)
+    result = np.zeros(len(query_pos), dtype=np.float64)
+    if len(values) == 0:
+        return result
+
+    k = min(k, len(values))
+    for chunk in batch_chunks(len(query_pos), len(values)):
+        dists = batch_distances(xs, ys, query_pos[chunk])
+        # Select the k nearest points; on distance ties, prefer the earlier point like the stable sort does
+        kth_dist = np.partition(dists, k - 1, axis=1)[:, k - 1:k]
+        closer = dists < kth_dist
+        tied = dists == kth_dist
+        needed = k - closer.sum(axis=1, keepdims=True)
+        nearest = closer | (tied & (np.cumsum(tied, axis=1) <= needed))
+        weights = np.where(nearest, 1.0 / (dists + epsilon), 0.0)
+        weighted_sum = weights @ values
+        total_weight = weights.sum(axis=1)
+        valid = total_weight > epsilon
+        result[chunk] = np.where(valid, weighted_sum / np.where(valid, total_weight, 1.0), 0.0)
+    return result
+
+# Weighted Median (batch)
+# The value order is the same for every query, only the weights differ. Pass presorted=True
+# if the arrays are already sorted by value, e.g. from ControlPointSet.sorted_arrays.
+def get_object_scales_weighted_median(xs, ys, values, query_pos, presorted=False):
+    epsilon = 1e-8
+    query_pos = np.asarray(query_pos, dtype=np.float64).reshape(-1, 2)
+    result = np.zeros(len(query_pos), dtype=np.float64)
+    if len(values) == 0:
+        return result
+
+    if not presorted:
+        order = np.argsort(values, kind="stable")
+        xs, ys, values = xs[order], ys[order], values[order]
+    for chunk in batch_chunks(len(query_pos), len(values)):
+        weights = 1.0 / (batch_distances(xs, ys, query_pos[chunk]) + epsilon)
+        cumulative_weight = np.cumsum(weights, axis=1)
+        total_weight = cumulative_weight[:, -1:]
+        # Cumulative weights are ascending, so the count below half the total is the index of the median
+        median_index = np.count_nonzero(cumulative_weight < total_weight / 2, axis=1)
+        result[chunk] = values[median_index]
+    return result
+
+# Harmonic Mean (batch)
+def get_object_scales_harmonic_mean(xs, ys, values, query_pos):
+    epsilon = 1e-8
+    query_pos = np.asarray(query_pos, dtype=np.float64).reshape(-1, 2)
+    result = np.zeros(len(query_pos), dtype=np.float64)
+    if len(values) == 0:
+        return result
+
+    inverse_values = 1.0 / values
+    for chunk in batch_chunks(len(query_pos), len(values)):
+        weights = 1.0 / (batch_distances(xs, ys, query_pos[chunk]) + epsilon)
+        weighted_inverse = weights @ inverse_values
+        total_weight = weights.sum(axis=1)
+        valid = weighted_inverse > epsilon
+        result[chunk] = np.where(valid, total_weight / np.where(valid, weighted_inverse, 1.0), values.mean())
+    return result
+
+# Batch evaluation functions, in the same order as weighting_modes
+batch_weighting_functions = [
+    get_object_scales_linear,
+    get_object_scales_inverse_square,
+    get_object_scales_exponential,
+    get_object_scales_gaussian,
+    get_object_scales_max_nearby,
+    get_object_scales_weighted_median,
+    get_object_scales_harmonic_mean
+]
+
+# Evaluates the scale at each of the (N, 2) query positions, using the given weighting mode
+def get_object_scales(control_points, query_pos, mode):
+    if batch_weighting_functions[mode] is get_object_scales_weighted_median:
+        return get_object_scales_weighted_median(*control_points.sorted_arrays, query_pos, presorted=True)
+    return batch_weighting_functions[mode](control_points.xs, control_points.ys, control_points.values, query_pos)
+
+# Incremental evaluation of tracked positions
+#
+# The sum-based modes compute weighted_sum / total_weight over all points. TrackedScales keeps these
+# accumulators for a registered set of query positions and listens to the control point set, so that
+# adding, removing or editing a single point only applies that point's contribution: O(tracked positions)
+# per change, instead of O(tracked positions * points) for evaluating everything again.
+
+# Weighting modes that TrackedScales can update incrementally
+TRACKED_MODES = (0, 1, 2, 3, 6)
+
+# If a removed point carried more than this times the remaining total weight of a position,
+# subtracting it cancels most significant digits, so that position is recomputed from scratch
+TRACKED_CANCELLATION_RATIO = 1e4
+
+# Returns the weights of the given sum-based mode for an array of distances
+def tracked_weights(mode, dist):
+    epsilon = 1e-8
+    if mode == 0 or mode == 6:
+        return 1.0 / (dist + epsilon)
+    elif mode == 1:
+        return 1.0 / ((dist ** 2) + epsilon)
+    elif mode == 2:
+        return np.exp(-dist * EXPONENTIAL_DECAY_FACTOR)
+    elif mode == 3:
+        return np.exp(-((dist ** 2) / (2 * (GAUSSIAN_SIGMA ** 2))))
+    raise ValueError(f"weighting mode {mode} is not sum-based")
+
+class TrackedScales:
+    def __init__(self, control_points, positions=(), modes=TRACKED_MODES):
+        self.control_points = control_points
+        self.modes = modes
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.recompute()
+        control_points.listeners.append(self)
+
+    # Stops listening to the control point set
+    def close(self):
+        self.control_points.listeners.remove(self)
+
+    # Returns the (positions, points) weight matrix of a mode. For Harmonic Mean, the numerator
+    # accumulates weight / value instead of weight * value.
+    def contributions(self, mode, positions, xs, ys, values):
+        weights = tracked_weights(mode, batch_distances(xs, ys, positions))
+        return weights @ (1.0 / values if mode == 6 else values), weights.sum(axis=1)
+
+    # Evaluates the accumulators of the given position rows and modes from all points
+    def recompute(self, rows=None, modes=None):
+        if rows is None:
+            rows = slice(None)
+            self.weighted_sums = {mode: np.zeros(len(self.positions)) for mode in self.modes}
+            self.total_weights = {mode: np.zeros(len(self.positions)) for mode in self.modes}
+            self.updates = 0
+        cps = self.control_points
+        positions = self.positions[rows]
+        for mode in self.modes if modes is None else modes:
+            weighted_sum = np.zeros(len(positions))
+            total_weight = np.zeros(len(positions))
+            for chunk in batch_chunks(len(positions), len(cps)):
+                chunk_sum, chunk_weight = self.contributions(mode, positions[chunk], cps.xs, cps.ys, cps.values)
+                weighted_sum[chunk] = chunk_sum
+                total_weight[chunk] = chunk_weight
+            self.weighted_sums[mode][rows] = weighted_sum
+            self.total_weights[mode][rows] = total_weight
+
+    # Adds positions to track, returns the index of the first one
+    def track(self, positions):
+        first = len(self.positions)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        self.positions = np.concatenate((self.positions, positions))
+        for mode in self.modes:
+            self.weighted_sums[mode] = np.concatenate((self.weighted_sums[mode], np.zeros(len(positions))))
+            self.total_weights[mode] = np.concatenate((self.total_weights[mode], np.zeros(len(positions))))
+        self.recompute(slice(first, None))
+        return first
+
+    # Stops tracking the positions with the given indices, indices of later positions shift down
+    def untrack(self, indices):
+        keep = np.ones(len(self.positions), dtype=bool)
+        keep[list(indices)] = False
+        self.positions = self.positions[keep]
+        for mode in self.modes:
+            self.weighted_sums[mode] = self.weighted_sums[mode][keep]
+            self.total_weights[mode] = self.total_weights[mode][keep]
+
+    # Returns the weights of the point at pos for all tracked positions
+    def point_weights(self, mode, pos):
+        dx = self.positions[:, 0] - pos[0]
+        dy = self.positions[:, 1] - pos[1]
+        return tracked_weights(mode, np.sqrt(dx * dx + dy * dy))
+
+    # Adds sign times the contribution of a single point to all accumulators
+    def apply(self, pos, value, sign):
+        for mode in self.modes:
+            weights = self.point_weights(mode, pos)
+            self.weighted_sums[mode] += sign * weights * (1.0 / value if mode == 6 else value)
+            self.total_weights[mode] += sign * weights
+            if sign < 0:
+                cancelled = np.flatnonzero(weights > TRACKED_CANCELLATION_RATIO * self.total_weights[mode])
+                if len(cancelled):
+                    self.recompute(cancelled, [mode])
+        self.updates += 1
+
+    def point_added(self, index):
+        self.apply(self.control_points.pos(index), self.control_points.value(index), 1.0)
+
+    def point_removed(self, pos, value):
+        self.apply(pos, value, -1.0)
+
+    # The weights of an edited point stay the same, only its weighted values change
+    def point_changed(self, index, old_value):
+        pos = self.control_points.pos(index)
+        value = self.control_points.value(index)
+        for mode in self.modes:
+            weights = self.point_weights(mode, pos)
+            self.weighted_sums[mode] += weights * ((1.0 / value - 1.0 / old_value) if mode == 6 else (value - old_value))
+        self.updates += 1
+
+    def points_reset(self):
+        self.recompute()
+
+    # Returns the scales of all tracked positions, with the same fallbacks as the get_object_scale_* functions
+    def scales(self, mode):
+        epsilon = 1e-8
+        weighted_sum = self.weighted_sums[mode]
+        total_weight = self.total_weights[mode]
+        if len(self.control_points) == 0:
+            return np.zeros(len(self.positions))
+        if mode == 6:
+            valid = weighted_sum > epsilon
+            return np.where(valid, total_weight / np.where(valid, weighted_sum, 1.0), self.control_points.values.mean())
+        fallback = self.control_points.values.mean() if mode in (2, 3) else 0.0
+        valid = total_weight > epsilon
+        return np.where(valid, weighted_sum / np.where(valid, total_weight, 1.0), fallback)
+
+# Baked scale lookup texture
+#
+# For control points that rarely change, the scale field of a world rect is evaluated once on a grid
+# of samples, LOOKUP_TEXTURE_CELL_SIZE apart. Queries are then answered in O(1) by bilinear interpolation
+# between the four surrounding samples. Smaller cells are more accurate, but take longer to bake.
+
+class ScaleLookupTexture:
+    def __init__(self, rect=(0, 0, WIDTH, HEIGHT), cell_size=LOOKUP_TEXTURE_CELL_SIZE, error_samples=LOOKUP_TEXTURE_ERROR_SAMPLES):
+        self.rect = rect # (x, y, width, height) of the baked area, queries outside are clamped to it
+        self.cell_size = cell_size
+        self.error_samples = error_samples # None skips measuring the error, e.g. for display only textures
+        self.columns = max(2, math.ceil(rect[2] / cell_size) + 1)
+        self.rows = max(2, math.ceil(rect[3] / cell_size) + 1)
+        self.samples = None # (columns, rows) array of baked scale values
+        self.rows_of_samples = None # The same as nested lists, faster to index from Python
+        self.max_error = None # Measured max difference to the exact scale, not a bound. None if error_samples is None
+        self.key = None
+
+    # Returns the world positions of the samples, as a (columns * rows, 2) array
+    def sample_positions(self):
+        grid_x, grid_y = np.meshgrid(
+            np.linspace(self.rect[0], self.rect[0] + self.rect[2], self.columns),
+            np.linspace(self.rect[1], self.rect[1] + self.rect[3], self.rows),
+            indexing="ij")
+        return np.column_stack((grid_x.ravel(), grid_y.ravel()))
+
+    # Evaluates the scale at every sample, and measures the max error at the center and at error_samples
+    # random positions of each cell. The error of the non-smooth modes can peak anywhere in a cell, so the
+    # measured max error is a lower estimate of the true one.
+    def bake(self, control_points, mode):
+        self.samples = get_object_scales(control_points, self.sample_positions(), mode).reshape(self.columns, self.rows)
+        self.rows_of_samples = self.samples.tolist()
+        self.key = (id(control_points), control_points.version, mode)
+        if self.error_samples is None:
+            self.max_error = None
+            return
+
+        step_x = self.rect[2] / (self.columns - 1)
+        step_y = self.rect[3] / (self.rows - 1)
+        corner_x, corner_y = np.meshgrid(
+            self.rect[0] + step_x * np.arange(self.columns - 1),
+            self.rect[1] + step_y * np.arange(self.rows - 1),
+            indexing="ij")
+        corners = np.column_stack((corner_x.ravel(), corner_y.ravel()))
+        rng = np.random.default_rng(0) # Fixed, so baking the same points again measures the same error
+        offsets = np.vstack(([[0.5, 0.5]], rng.random((self.error_samples, 2)))) * (step_x, step_y)
+        positions = (corners[:, np.newaxis, :] + offsets).reshape(-1, 2)
+        exact = get_object_scales(control_points, positions, mode)
+        self.max_error = float(np.abs(self.sample_batch(control_points, mode, positions) - exact).max())
+
+    # Bakes again if control_points or mode changed since the last bake
+    def update(self, control_points, mode):
+        if self.key != (id(control_points), control_points.version, mode):
+            self.bake(control_points, mode)
+
+    # Returns the bilinearly interpolated scale at pos
+    def sample(self, control_points, mode, pos):
+        self.update(control_points, mode)
+        u = min(max((pos[0] - self.rect[0]) / self.rect[2], 0.0), 1.0) * (self.columns - 1)
+        v = min(max((pos[1] - self.rect[1]) / self.rect[3], 0.0), 1.0) * (self.rows - 1)
+        col = min(int(u), self.columns - 2)
+        row = min(int(v), self.rows - 2)
+        fu = u - col
+        fv = v - row
+        samples = self.rows_of_samples
+        top = samples[col][row] + fu * (samples[col + 1][row] - samples[col][row])
+        bottom = samples[col][row + 1] + fu * (samples[col + 1][row + 1] - samples[col][row + 1])
+        return top + fv * (bottom - top)
+
+    # Returns the bilinearly interpolated scales at an (N, 2) array of positions
+    def sample_batch(self, control_points, mode, query_pos):
+        self.update(control_points, mode)
+        query_pos = np.asarray(query_pos, dtype=np.float64).reshape(-1, 2)
+        u = np.clip((query_pos[:, 0] - self.rect[0]) / self.rect[2], 0.0, 1.0) * (self.columns - 1)
+        v = np.clip((query_pos[:, 1] - self.rect[1]) / self.rect[3], 0.0, 1.0) * (self.rows - 1)
+        col = np.minimum(u.astype(np.intp), self.columns - 2)
+        row = np.minimum(v.astype(np.intp), self.rows - 2)
+        fu = u - col
+        fv = v - row
+        samples = self.samples
+        top = samples[col, row] + fu * (samples[col + 1, row] - samples[col, row])
+        bottom = samples[col, row + 1] + fu * (samples[col + 1, row + 1] - samples[col, row + 1])
+        return top + fv * (bottom - top)
+
+    # Returns the bilinearly interpolated scales on the grid of all combinations of xs and ys, as a
+    # (len(xs), len(ys)) array. Interpolates along x and then along y, cheaper than sample_batch() on every position.
+    def sample_grid(self, control_points, mode, xs, ys):
+        self.update(control_points, mode)
+        u = np.clip((np.asarray(xs, dtype=np.float64) - self.rect[0]) / self.rect[2], 0.0, 1.0) * (self.columns - 1)
+        v = np.clip((np.asarray(ys, dtype=np.float64) - self.rect[1]) / self.rect[3], 0.0, 1.0) * (self.rows - 1)
+        col = np.minimum(u.astype(np.intp), self.columns - 2)
+        row = np.minimum(v.astype(np.intp), self.rows - 2)
+        fu = (u - col)[:, np.newaxis]
+        fv = v - row
+        columns = self.samples[col] + fu * (self.samples[col + 1] - self.samples[col])
+        return columns[:, row] + fv * (columns[:, row + 1] - columns[:, row])
+
+# Truncated kernel evaluation
+#
+# Exponential Decay and Gaussian Weighting give far away points a weight that is practically zero.
+# The truncated functions only visit points within a cutoff radius, found via the spatial grid, so
+# a query costs O(points nearby) instead of O(all points). They return (scale, error_bound), where
+# error_bound is the largest possible difference to the exact get_object_scale_* result.
+
+# Weighted mean over the points within cutoff_radius of object_pos, returns (scale, error_bound).
+# candidates are the indices of points that may be within cutoff_radius, found via the spatial grid if None.
+def truncated_weighted_mean(control_points, object_pos, weight_function, cutoff_radius, candidates=None):
+    epsilon = 1e-8
+    if len(control_points) == 0:
+        return 0.0, 0.0
+
+    if candidates is None:
+        candidates = np.array(control_points.grid.candidates(object_pos, cutoff_radius), dtype=np.intp)
+    dx = control_points.xs[candidates] - object_pos[0]
+    dy = control_points.ys[candidates] - object_pos[1]
+    dist = np.sqrt(dx * dx + dy * dy)
+    inside = dist <= cutoff_radius
+    weights = weight_function(dist[inside])
+    weighted_sum = weights @ control_points.values[candidates[inside]]
+    total_weight = weights.sum()
+
+    # Each skipped point has a weight below the weight at the cutoff radius, and a value within the value range.
+    # Adding skipped_weight at worst pulls the mean towards the far end of the value range.
+    skipped_weight = (len(control_points) - np.count_nonzero(inside)) * weight_function(cutoff_radius)
+    value_range = control_points.max_value - control_points.min_value
+    if total_weight > epsilon:
+        return weighted_sum / total_weight, value_range * skipped_weight / (total_weight + skipped_weight)
+
+    # Same fallback as the exact functions. If the skipped points could lift the exact total weight above epsilon,
+    # the exact result is a weighted mean instead, which can be anywhere in the value range.
+    error_bound = value_range if total_weight + skipped_weight > epsilon else 0.0
+    return control_points.values.mean(), error_bound
+
+# Exponential Decay (truncated)
+def get_object_scale_exponential_truncated(control_points, object_pos, cutoff_radius=EXPONENTIAL_CUTOFF_RADIUS, candidates=None):
+    decay_factor = EXPONENTIAL_DECAY_FACTOR
+    return truncated_weighted_mean(control_points, object_pos, lambda dist: np.exp(-dist * decay_factor), cutoff_radius, candidates)
+
+# Gaussian Weighting (truncated)
+def get_object_scale_gaussian_truncated(control_points, object_pos, cutoff_radius=GAUSSIAN_CUTOFF_RADIUS, candidates=None):
+    sigma = GAUSSIAN_SIGMA
+    return truncated_weighted_mean(control_points, object_pos, lambda dist: np.exp(-((dist ** 2) / (2 * (sigma ** 2)))), cutoff_radius, candidates)
+
+# Temporal coherence
+#
+# Queries that move a little per frame, like the mouse or a character, keep seeing the same nearby points.
+# CoherentQuery finds the points around an anchor position once: for Max-Nearby Influence all points within
+# d_k(anchor) + 2 * margin, d_k being the distance to the k-th nearest point, and for the truncated kernels all
+# points within cutoff_radius + margin. While the query stays within margin of the anchor, these contain every
+# point the full evaluation would use, so only they are evaluated, with the same result. Moving further away,
+# or changing the control points or weighting mode, re-anchors the query at its current position.
+
+# Weighting modes that CoherentQuery supports, Exponential Decay and Gaussian Weighting are truncated
+COHERENT_MODES = (2, 3, 4)
+
+class CoherentQuery:
+    def __init__(self, margin=COHERENCE_MARGIN, k=3):
+        self.margin = margin
+        self.k = k
+        self.key = None # Identity and version of the control point set, and weighting mode, the candidates belong to
+        self.anchor = None
+        self.candidates = None
+        self.hits = 0
+        self.misses = 0
+
+    # Searches the candidate points around object_pos, unless the query is still within margin of the anchor
+    def update(self, control_points, object_pos, mode):
+        key = (id(control_points), control_points.version, mode)
+        if key == self.key and distance(object_pos, self.anchor) <= self.margin:
+            self.hits += 1
+            return
+
+        self.misses += 1
+        if mode == 4:
+            nearest = control_points.grid.nearest(object_pos, self.k)
+            radius = (nearest[-1][0] if nearest else 0.0) + 2 * self.margin
+        elif mode == 2:
+            radius = EXPONENTIAL_CUTOFF_RADIUS + self.margin
+        elif mode == 3:
+            radius = GAUSSIAN_CUTOFF_RADIUS + self.margin
+        else:
+            raise ValueError(f"weighting mode {mode} has no coherent evaluation")
+        self.candidates = np.array(sorted(control_points.grid.query_radius(object_pos, radius)), dtype=np.intp)
+        self.xs = control_points.xs[self.candidates]
+        self.ys = control_points.ys[self.candidates]
+        self.values = control_points.values[self.candidates]
+        self.anchor = (object_pos[0], object_pos[1])
+        self.key = key
+
+    # Returns (scale, error_bound) at object_pos. error_bound is None for Max-Nearby Influence, which is exact.
+    def get(self, control_points, object_pos, mode):
+        self.update(control_points, object_pos, mode)
+        if mode == 2:
+            return get_object_scale_exponential_truncated(control_points, object_pos, candidates=self.candidates)
+        elif mode == 3:
+            return get_object_scale_gaussian_truncated(control_points, object_pos, candidates=self.candidates)
+        return self.max_nearby(object_pos), None
+
+    # Max-Nearby Influence over the candidates. Distance ties are broken by point index.
+    def max_nearby(self, object_pos):
+        epsilon = 1e-8
+        dx = self.xs - object_pos[0]
+        dy = self.ys - object_pos[1]
+        dist = np.sqrt(dx * dx + dy * dy)
+        nearest = np.lexsort((self.candidates, dist))[:self.k]
+        weights = 1.0 / (dist[nearest] + epsilon)
+        total_weight = weights.sum()
+        return (weights @ self.values[nearest] / total_weight).item() if total_weight > epsilon else 0.0
+
+# Barnes-Hut approximation
+#
+# For the inverse-distance modes, far away points contribute smoothly, so a cluster of them can be replaced
+# by a single pseudo-point at its centroid, weighted by the number of points and carrying the sum of their
+# values. PointQuadtree groups the points into a quadtree with these aggregates per node. A node is used as
+# a pseudo-point if its size divided by its distance to the query is below the opening angle theta, otherwise
+# its children, or in leaves its points, are visited. theta=0.0 is exact, larger values are faster and less
+# accurate. A query visits O(log N) nodes instead of all N points.
+
+# Weighting modes that can be approximated
+APPROX_MODES = (0, 1, 6)
+
+# Depth of the quadtree at most, points are located on a 2^16 x 2^16 grid
+QUADTREE_MAX_DEPTH = 16
+
+# Returns the Morton codes of integer cell coordinates, interleaving the bits of columns and rows
+def morton_codes(cols, rows):
+    def spread(v):
+        v = v.astype(np.uint64)
+        for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+            v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+        return v
+    return spread(cols) | (spread(rows) << np.uint64(1))
+
+# Returns (owners repeated count times, start + 0 .. count - 1) for each (owner, start, count)
+def expand_ranges(owners, starts, counts):
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(owners, counts), np.repeat(starts, counts) + offsets
+
+# Quadtree over points sorted by Morton code, so the points of each node are contiguous.
+# Nodes are stored level by level in flat arrays, the children of a node are contiguous as well.
+class PointQuadtree:
+    def __init__(self, xs, ys, values, leaf_size=QUADTREE_LEAF_SIZE):
+        num_points = len(values)
+        self.visits = 0 # Number of (query, node) pairs visited by the last weighted_sums() call
+        if num_points == 0:
+            self.num_nodes = 0
+            return
+
+        # Sort the points along the Morton curve over their bounding square
+        min_x, min_y = xs.min(), ys.min()
+        self.size = max(xs.max() - min_x, ys.max() - min_y, 1.0) * (1.0 + 1e-9)
+        cells = 1 << QUADTREE_MAX_DEPTH
+        cols = np.minimum(((xs - min_x) * (cells / self.size)).astype(np.int64), cells - 1)
+        rows = np.minimum(((ys - min_y) * (cells / self.size)).astype(np.int64), cells - 1)
+        codes = morton_codes(cols, rows)
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        self.xs = np.ascontiguousarray(xs[order], dtype=np.float64)
+        self.ys = np.ascontiguousarray(ys[order], dtype=np.float64)
+        self.values = np.ascontiguousarray(values[order], dtype=np.float64)
+        self.inverse_values = 1.0 / self.values
+
+        # Nodes of each level are the runs of equal code prefixes, below parents that are not leaves
+        levels = []
+        for level in range(QUADTREE_MAX_DEPTH + 1):
+            prefixes = codes >> np.uint64(2 * (QUADTREE_MAX_DEPTH - level))
+            starts = np.flatnonzero(np.concatenate(([True], prefixes[1:] != prefixes[:-1])))
+            counts = np.diff(np.append(starts, num_points))
+            prefixes = prefixes[starts]
+            parents = np.zeros(len(starts), dtype=np.intp)
+            if level > 0:
+                parents = np.minimum(np.searchsorted(parent_prefixes, prefixes >> np.uint64(2)), len(parent_prefixes) - 1)
+                keep = (parent_prefixes[parents] == prefixes >> np.uint64(2)) & parent_internal[parents]
+                starts, counts, prefixes, parents = starts[keep], counts[keep], prefixes[keep], parents[keep]
+            internal = counts > leaf_size if level < QUADTREE_MAX_DEPTH else np.zeros(len(starts), dtype=bool)
+            levels.append((starts, counts, parents, level))
+            if not internal.any():
+                break
+            parent_prefixes, parent_internal = prefixes, internal
+
+        # Flatten the levels, children of a node are the nodes of the next level with it as parent
+        offsets = np.cumsum([0] + [len(starts) for starts, _, _, _ in levels])
+        child_starts = []
+        child_counts = []
+        for i, (starts, _, _, _) in enumerate(levels):
+            if i + 1 < len(levels):
+                next_parents = levels[i + 1][2]
+                first = np.searchsorted(next_parents, np.arange(len(starts)), side="left")
+                last = np.searchsorted(next_parents, np.arange(len(starts)), side="right")
+                child_starts.append(offsets[i + 1] + first)
+                child_counts.append(last - first)
+            else:
+                child_starts.append(np.zeros(len(starts), dtype=np.intp))
+                child_counts.append(np.zeros(len(starts), dtype=np.intp))
+        self.num_nodes = offsets[-1]
+        self.point_starts = np.concatenate([starts for starts, _, _, _ in levels])
+        self.point_counts = np.concatenate([counts for _, counts, _, _ in levels])
+        self.child_starts = np.concatenate(child_starts)
+        self.child_counts = np.concatenate(child_counts)
+        self.node_sizes = np.concatenate([np.full(len(starts), self.size / (1 << level)) for starts, _, _, level in levels])
+
+        # Aggregates, from prefix sums over the sorted points
+        def node_sums(array):
+            prefix_sums = np.concatenate(([0.0], np.cumsum(array)))
+            return prefix_sums[self.point_starts + self.point_counts] - prefix_sums[self.point_starts]
+        self.node_xs = node_sums(self.xs) / self.point_counts
+        self.node_ys = node_sums(self.ys) / self.point_counts
+        self.node_value_sums = node_sums(self.values)
+        self.node_inverse_value_sums = node_sums(self.inverse_values)
+
+    # Returns (total_weight, weighted_sum) arrays for the (N, 2) query positions, summing weight_function(dist)
+    # and weight_function(dist) * value, or weight_function(dist) / value if inverse is True, over all points
+    def weighted_sums(self, query_pos, weight_function, theta=QUADTREE_THETA, inverse=False):
+        query_pos = np.asarray(query_pos, dtype=np.float64).reshape(-1, 2)
+        total_weight = np.zeros(len(query_pos))
+        weighted_sum = np.zeros(len(query_pos))
+        self.visits = 0
+        if self.num_nodes == 0:
+            return total_weight, weighted_sum
+        point_values = self.inverse_values if inverse else self.values
+        node_values = self.node_inverse_value_sums if inverse else self.node_value_sums
+
+        for first in range(0, len(query_pos), QUADTREE_QUERY_CHUNK):
+            chunk = query_pos[first:first + QUADTREE_QUERY_CHUNK]
+            qx, qy = chunk[:, 0], chunk[:, 1]
+            chunk_weight = np.zeros(len(chunk))
+            chunk_sum = np.zeros(len(chunk))
+
+            # (query, node) pairs still to visit, starting at the root
+            queries = np.arange(len(chunk))
+            nodes = np.zeros(len(chunk), dtype=np.intp)
+            while len(queries):
+                self.visits += len(queries)
+                dx = self.node_xs[nodes] - qx[queries]
+                dy = self.node_ys[nodes] - qy[queries]
+                dist = np.sqrt(dx * dx + dy * dy)
+
+                # Far nodes as pseudo-points
+                far = self.node_sizes[nodes] < theta * dist
+                weights = weight_function(dist[far])
+                chunk_weight += np.bincount(queries[far], weights * self.point_counts[nodes[far]], minlength=len(chunk))
+                chunk_sum += np.bincount(queries[far], weights * node_values[nodes[far]], minlength=len(chunk))
+
+                # Points of near leaves one by one
+                leaf = ~far & (self.child_counts[nodes] == 0)
+                point_queries, points = expand_ranges(queries[leaf], self.point_starts[nodes[leaf]], self.point_counts[nodes[leaf]])
+                dx = self.xs[points] - qx[point_queries]
+                dy = self.ys[points] - qy[point_queries]
+                weights = weight_function(np.sqrt(dx * dx + dy * dy))
+                chunk_weight += np.bincount(point_queries, weights, minlength=len(chunk))
+                chunk_sum += np.bincount(point_queries, weights * point_values[points], minlength=len(chunk))
+
+                # Children of near internal nodes are visited next
+                inner = ~far & ~leaf
+                queries, nodes = expand_ranges(queries[inner], self.child_starts[nodes[inner]], self.child_counts[nodes[inner]])
+
+            total_weight[first:first + len(chunk)] = chunk_weight
+            weighted_sum[first:first + len(chunk)] = chunk_sum
+        return total_weight, weighted_sum
+
+# Approximates the scale at each of the (N, 2) query positions with the Barnes-Hut quadtree of control_points.
+# mode must be one of APPROX_MODES. Fallbacks are the same as for the exact get_object_scale_* functions.
+def get_object_scales_approx(control_points, query_pos, mode, theta=QUADTREE_THETA):
+    if mode not in APPROX_MODES:
+        raise ValueError(f"weighting mode {mode} can't be approximated")
+    epsilon = 1e-8
+    query_pos = np.asarray(query_pos, dtype=np.float64).reshape(-1, 2)
+    if len(control_points) == 0:
+        return np.zeros(len(query_pos))
+
+    # Harmonic Mean sums weight / value, and divides the other way round
+    total_weight, weighted_sum = control_points.quadtree.weighted_sums(query_pos, lambda dist: tracked_weights(mode, dist), theta, inverse=(mode == 6))
+    if mode == 6:
+        valid = weighted_sum > epsilon
+        return np.where(valid, total_weight / np.where(valid, weighted_sum, 1.0), control_points.values.mean())
+    valid = total_weight > epsilon
+    return np.where(valid, weighted_sum / np.where(valid, total_weight, 1.0), 0.0)
+
+# Approximates the scale at object_pos, see get_object_scales_approx()
+def get_object_scale_approx(control_points, object_pos, mode, theta=QUADTREE_THETA):
+    return get_object_scales_approx(control_points, object_pos, mode, theta)[0].item()
+
+# Point set files
+#
+# Binary format: a 64 byte header, followed by the x, y and value arrays as little-endian float64,
+# each with room for capacity points, of which the first count are used. The free capacity lets
+# PointSetWriter append points in place. Files are memory-mapped when loaded, so the data is only
+# read from disk when accessed, and loading takes the same time for any number of points.
+
+POINT_SET_MAGIC = b"CPSET\r\n\x1a"
+POINT_SET_FORMAT_VERSION = 1
+POINT_SET_HEADER = np.dtype({
+    "names": ["magic", "version", "count", "capacity"],
+    "formats": ["S8", "<u4", "<u8", "<u8"],
+    "offsets": [0, 8, 16, 24],
+    "itemsize": 64
+})
+
+# Writes a new header to an open file
+def write_point_set_header(f, count, capacity):
+    header = np.zeros((), dtype=POINT_SET_HEADER)
+    header["magic"] = POINT_SET_MAGIC
+    header["version"] = POINT_SET_FORMAT_VERSION
+    header["count"] = count
+    header["capacity"] = capacity
+    f.seek(0)
+    f.write(header.tobytes())
+
+# Reads and checks the header of a point set file, returns (count, capacity)
+def read_point_set_header(path):
+    with open(path, "rb") as f:
+        data = f.read(POINT_SET_HEADER.itemsize)
+        f.seek(0, 2)
+        size = f.tell()
+    if len(data) < POINT_SET_HEADER.itemsize:
+        raise ValueError(f"{path} is too short to be a point set file")
+    header = np.frombuffer(data, dtype=POINT_SET_HEADER)[0]
+    if header["magic"] != POINT_SET_MAGIC:
+        raise ValueError(f"{path} is not a point set file")
+    if header["version"] != POINT_SET_FORMAT_VERSION:
+        raise ValueError(f"{path} has unsupported point set format version {header['version']}")
+    count = int(header["count"])
+    capacity = int(header["capacity"])
+    if count > capacity or size < POINT_SET_HEADER.itemsize + 3 * 8 * capacity:
+        raise ValueError(f"{path} is truncated")
+    return count, capacity
+
+# Memory-maps the point data of a file as a (3, capacity) array of x, y and value rows.
+# mode is a numpy.memmap mode: "r" read-only, "r+" writes go to the file, "c" writes stay in memory.
+def map_point_set(path, mode="r"):
+    count, capacity = read_point_set_header(path)
+    if capacity == 0:
+        return count, np.zeros((3, 0), dtype="<f8")
+    return count, np.memmap(path, dtype="<f8", mode=mode, offset=POINT_SET_HEADER.itemsize, shape=(3, capacity))
+
+# Writes count points of a (3, capacity) data array to a point set file. The file is written under a
+# temporary name and then replaces path, so mappings of the old file, e.g. sets loaded from path with
+# load_point_set(), keep their data and can even be the source of data.
+def replace_point_set_file(path, count, data):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            write_point_set_header(f, count, data.shape[1])
+            f.write(np.ascontiguousarray(data, dtype="<f8").tobytes())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+# Saves a control point set to a point set file, with room for capacity points
+def save_point_set(path, control_points, capacity=None):
+    count = len(control_points)
+    data = np.zeros((3, max(count, capacity or 0)), dtype="<f8")
+    data[0, :count] = control_points.xs
+    data[1, :count] = control_points.ys
+    data[2, :count] = control_points.values
+    replace_point_set_file(path, count, data)
+
+# Loads a point set file without copying the point data. The returned set is backed by a copy-on-write
+# mapping of the file: changes to it are not written back, and moving beyond the file's capacity copies
+# the data into memory. Pass control_points to load into an existing set, e.g. one with listeners.
+def load_point_set(path, control_points=None):
+    if control_points is None:
+        control_points = ControlPointSet()
+    count, data = map_point_set(path, mode="c")
+    control_points.adopt_arrays(data[0], data[1], data[2], count)
+    return control_points
+
+# Appends points to a point set file in place, creating the file if it doesn't exist.
+# Points are written into the free capacity and the count in the header is updated after each append,
+# so a reader that maps the file afterwards sees all appended points. close() flushes them to disk. When the capacity is exhausted,
+# the file is replaced by one with twice the capacity, so appending is amortized O(1) per point.
+class PointSetWriter:
+    def __init__(self, path, capacity=1024):
+        self.path = path
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                write_point_set_header(f, 0, capacity)
+                f.truncate(POINT_SET_HEADER.itemsize + 3 * 8 * capacity)
+        self.count, self.data = map_point_set(path, mode="r+")
+        self.file = open(path, "r+b")
+        if self.capacity == 0:
+            self._grow(capacity)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        return self.data.shape[1]
+
+    # Moves the points into a new file with more capacity, which replaces the old one. The x, y and value
+    # rows start at capacity dependent offsets, so rewriting them in place would move the data under sets
+    # loaded from the old file.
+    def _grow(self, capacity):
+        capacity = max(capacity, 2 * self.capacity)
+        data = np.zeros((3, capacity), dtype="<f8")
+        data[:, :self.count] = self.data[:, :self.count]
+        del self.data
+        self.file.close()
+        replace_point_set_file(self.path, self.count, data)
+        self.file = open(self.path, "r+b")
+        _, self.data = map_point_set(self.path, mode="r+")
+
+    # Appends points from coordinate and value arrays
+    def append_arrays(self, xs, ys, values):
+        num_points = len(values)
+        if self.count + num_points > self.capacity:
+            self._grow(self.count + num_points)
+        self.data[0, self.count:self.count + num_points] = xs
+        self.data[1, self.count:self.count + num_points] = ys
+        self.data[2, self.count:self.count + num_points] = values
+        self.count += num_points
+        write_point_set_header(self.file, self.count, self.capacity)
+        self.file.flush()
+
+    def append(self, pos, value):
+        self.append_arrays((pos[0],), (pos[1],), (value,))
+
+    def close(self):
+        if self.file.closed:
+            return
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+        del self.data
+        self.file.close()
@@ -0,0 +1,147 @@
+# Scale query server
+#
+# Holds a control point set in memory and answers batched scale queries over TCP or a Unix socket.
+# Messages are JSON objects, one per line. Clients may pipeline: requests on a connection are handled
+# in order, and each response is written back as soon as it is ready. Responses echo the request "id".
+#
+#   {"id": 1, "op": "query", "mode": 3, "positions": [[x, y], ...]}    -> {"id": 1, "scales": [...]}
+#   {"id": 1, "op": "query", "mode": 0, "theta": 0.5, "positions": ...} -> {"id": 1, "scales": [...]}
+#   {"id": 2, "op": "set_points", "points": [[x, y, value], ...]}      -> {"id": 2, "count": n, "version": v}
+#   {"id": 3, "op": "add_points", "points": [[x, y, value], ...]}      -> {"id": 3, "count": n, "version": v}
+#   {"id": 4, "op": "remove_points", "indices": [i, ...]}              -> {"id": 4, "count": n, "version": v}
+#   {"id": 5, "op": "info"}                                            -> {"id": 5, "count": n, "version": v, "modes": [...]}
+#
+# "mode" is an index into weighting_modes, or a mode name. With "theta", scales are approximated with the
+# Barnes-Hut quadtree using that opening angle, which only the inverse-distance modes support. Failed requests get {"id": ..., "error": "..."}
+# and leave the point set unchanged.
+# Example:
+#
+#   python scaleserver.py --port 8765 --points 1000
+
+import argparse
+import asyncio
+import json
+import sys
+
+import numpy as np
+
+import scalecore
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_LINE_LENGTH = 64 * 1024 * 1024 # Longest accepted request line in bytes
+
+class ScaleServer:
+    def __init__(self, control_points=None):
+        self.control_points = control_points if control_points is not None else scalecore.ControlPointSet()
+
+    # Returns the weighting mode index for an index or mode name
+    @staticmethod
+    def parse_mode(mode):
+        if isinstance(mode, str):
+            return scalecore.weighting_modes.index(mode)
+        if not 0 <= mode < len(scalecore.weighting_modes):
+            raise ValueError(f"unknown weighting mode {mode}")
+        return mode
+
+    # Returns a (count, 3) array of points from a list of [x, y, value]
+    @staticmethod
+    def parse_points(points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        return points[:, 0], points[:, 1], points[:, 2]
+
+    # Returns the distinct point indices of a list, sorted from the highest down. All are checked before
+    # anything is removed, so an invalid request leaves the point set unchanged.
+    def parse_indices(self, indices):
+        if not isinstance(indices, list):
+            raise TypeError("indices must be a list")
+        for index in indices:
+            if not isinstance(index, int) or isinstance(index, bool):
+                raise TypeError(f"point index {index!r} is not an integer")
+            if not 0 <= index < len(self.control_points):
+                raise IndexError(f"point index {index} out of range")
+        return sorted(set(indices), reverse=True)
+
+    def point_set_state(self):
+        return {"count": len(self.control_points), "version": self.control_points.version}
+
+    # Handles one request, returns the response
+    def handle_request(self, request):
+        op = request.get("op")
+        if op == "query":
+            mode = self.parse_mode(request.get("mode", 0))
+            query_pos = np.asarray(request["positions"], dtype=np.float64).reshape(-1, 2)
+            if request.get("theta") is not None:
+                return {"scales": scalecore.get_object_scales_approx(self.control_points, query_pos, mode, float(request["theta"])).tolist()}
+            return {"scales": scalecore.get_object_scales(self.control_points, query_pos, mode).tolist()}
+        elif op == "set_points":
+            self.control_points.assign_arrays(*self.parse_points(request["points"]))
+            return self.point_set_state()
+        elif op == "add_points":
+            for x, y, value in zip(*self.parse_points(request["points"])):
+                self.control_points.append((x, y), value)
+            return self.point_set_state()
+        elif op == "remove_points":
+            # Remove from the highest index down, so swap-removes don't move points that are still to be removed
+            for index in self.parse_indices(request["indices"]):
+                self.control_points.remove(index)
+            return self.point_set_state()
+        elif op == "info":
+            return dict(self.point_set_state(), modes=scalecore.weighting_modes)
+        raise ValueError(f"unknown op {op!r}")
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.get("id")
+                    response = self.handle_request(request)
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    response = {"error": f"{type(e).__name__}: {e}"}
+                response["id"] = request_id
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    # Starts listening on a Unix socket if unix_path is given, otherwise on TCP. Returns the asyncio server.
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        if unix_path is not None:
+            return await asyncio.start_unix_server(self.handle_client, unix_path, limit=MAX_LINE_LENGTH)
+        return await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE_LENGTH)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve batched scale queries over TCP or a Unix socket")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="TCP host to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port to listen on")
+    parser.add_argument("--unix", metavar="PATH", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--points", type=int, default=scalecore.INITIAL_NUM_POINTS, help="number of random control points to start with")
+    return parser.parse_args(argv)
+
+async def serve(args):
+    control_points = scalecore.ControlPointSet(
+        scalecore.generate_random_point(scalecore.WIDTH, scalecore.HEIGHT, scalecore.DEFAULT_POINT_MIN_VALUE, scalecore.DEFAULT_POINT_MAX_VALUE)
+        for _ in range(args.points))
+    server = await ScaleServer(control_points).start(args.host, args.port, args.unix)
+    where = args.unix if args.unix is not None else f"{args.host}:{args.port}"
+    print(f"Serving scale queries on {where} with {len(control_points)} control points", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,48 @@
+# Interactive pygame front end of the prototype
+#
+# The interpolation math lives in scalecore.py, this module only adds the window, input handling
+# and rendering. pygame is initialized and the window opened by main(), not on import.
+
 import pygame
 import pygame.gfxdraw
 import sys
 import math
+import time
+import csv
+import json
 import random
+from collections import OrderedDict
+import numpy as np
 
+from scalecore import (
+    PROTOTYPE_VERSION, WIDTH, HEIGHT, DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE, DEFAULT_POINT_VALUE,
+    INITIAL_NUM_POINTS, weighting_modes, APPROX_MODES, COHERENT_MODES, generate_random_point, batch_chunks,
+    ControlPointSet, ScaleCache, ScaleLookupTexture, CoherentQuery, get_object_scale, get_object_scale_approx,
+    get_object_scale_exponential_truncated, get_object_scale_gaussian_truncated, save_point_set, load_point_set)
 
-PROTOTYPE_VERSION = 0.3
 
 # Settings
-WIDTH, HEIGHT = 1280, 720 # Screen dimensions
-DEFAULT_POINT_MIN_VALUE = 10 # Minimum value for random points
-DEFAULT_POINT_MAX_VALUE = 150 # Maximum value for random points
-DEFAULT_POINT_VALUE = 50 # Default point value for manually added points
-INITIAL_NUM_POINTS = 5 # Number of initial points
 FONT_SIZE = 24 # Font size
 TOLERANCE_RADIUS = 10 # Tolerance for detecting clicks on existing points
+USE_TRUNCATED_KERNELS = False # Evaluate Exponential Decay and Gaussian Weighting only within the cutoff radius
+USE_LOOKUP_TEXTURE = False # Sample the scale from the baked lookup texture instead of evaluating it
+USE_SCALE_CACHE = True # Memoize scale results per quantized query position
+USE_APPROXIMATION = False # Approximate the inverse-distance modes with the Barnes-Hut quadtree
+USE_TEMPORAL_COHERENCE = False # Reuse the points found near the mouse while it moves less than COHERENCE_MARGIN
+TEXT_CACHE_SIZE = 512 # Maximum number of rendered text surfaces kept in the text cache
 DRAW_ANTIALIASED = True # Use antialising for text and lines
 DRAW_SHADED = True # Draw circles filled & shaded
 DRAW_OUTLINES = False # Draw circle outlines (only has an effect if DRAW_SHADED == True)
 DRAW_VALUE_TEXT = True # Draw value texts next to points
+DRAW_HEATMAP = False # Draw the scale field of the whole screen as background
+HEATMAP_CELL_SIZE = 8 # Distance between evaluated samples of the heatmap, which is upscaled to full resolution in between
+DRAW_BATCHED = True # Draw pass 1 rasterizes small circles with NumPy instead of one draw call per point, and skips hidden large circles
+BATCHED_MAX_RADIUS = 10 # Largest circle radius the batched draw pass 1 rasterizes with NumPy
+BATCHED_OCCLUDERS = 256 # Number of largest circles the batched draw pass 1 tests the other large circles against for being hidden
+FRAME_PROFILER_HISTORY = 3600 # Number of frames the frame profiler keeps for export
+FRAME_PROFILER_GRAPH_FRAMES = 120 # Number of frames shown in the frame profiler overlay
+FRAME_PROFILER_TRACE_PATH = "frame_profile.csv" # Export file of the frame profiler, .csv or .json
+POINT_SET_PATH = "points.cps" # Point set file saved with F5 and loaded with F9
 
 
 # Colors
@@ -32,27 +56,12 @@ CONTROLPOINT_RADIUS = (255, 160, 64)
 MOUSE_CENTER = (0, 0, 0)
 RESULT_RADIUS = (255, 255, 0)
 
-# Initialize pygame
-pygame.init()
-
-# Initialize screen
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption(f"Weighted character scaling v2 - Prototype v{PROTOTYPE_VERSION}")
-
-# Font setup
-font = pygame.font.Font(None, FONT_SIZE)  # Default font, size 24
+# Screen and font, initialized by main()
+screen = None
+font = None
 
-# Weighting modes
+# Current weighting mode, index into weighting_modes
 weighting_mode = 0
-weighting_modes = [
-    "Inverse Linear",
-    "Inverse Square",
-    "Exponential Decay",
-    "Gaussian Weighting",
-    "Max-Nearby Influence",
-    "Weighted Median",
-    "Harmonic Mean"
-]
 
 # Color remapping modes
 remapping_mode = 0
@@ -62,137 +71,6 @@ remapping_modes = [
     "Root"
 ]
 
-# Generate random control points
-def generate_random_point(width, height, scale_min, scale_max):
-    x = random.randint(0, width - 1)
-    y = random.randint(0, height - 1)
-    scale_value = random.randint(scale_min, scale_max)
-    return {"pos": (x, y), "value": scale_value}
-
-# Generate initial control points
-control_points = [generate_random_point(WIDTH, HEIGHT, DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE) for _ in range(INITIAL_NUM_POINTS)]
-
-# Function to compute distance
-def distance(point1, point2):
-    dx = point1[0] - point2[0]
-    dy = point1[1] - point2[1]
-    return math.sqrt(dx ** 2 + dy ** 2)
-
-# Inverse Linear
-def get_object_scale_linear(control_points, object_pos):
-    epsilon = 1e-8
-    weighted_sum = 0.0
-    total_weight = 0.0
-
-    for point in control_points:
-        dist = distance(point["pos"], object_pos)
-        weight = 1.0 / (dist + epsilon)
-
-        weighted_sum += weight * point["value"]
-        total_weight += weight
-
-    return (weighted_sum / total_weight) if total_weight > epsilon else 0.0
-
-# Inverse Square
-def get_object_scale_inverse_square(control_points, object_pos):
-    epsilon = 1e-8
-    weighted_sum = 0.0
-    total_weight = 0.0
-
-    for point in control_points:
-        dist = distance(point["pos"], object_pos)
-        weight = 1.0 / ((dist ** 2) + epsilon)
-
-        weighted_sum += weight * point["value"]
-        total_weight += weight
-
-    return (weighted_sum / total_weight) if total_weight > epsilon else 0.0
-
-# Exponential Decay
-def get_object_scale_exponential(control_points, object_pos):
-    epsilon = 1e-8
-    decay_factor = 0.05
-    weighted_sum = 0.0
-    total_weight = 0.0
-
-    for point in control_points:
-        dist = distance(point["pos"], object_pos)
-        weight = math.exp(-dist * decay_factor)
-
-        weighted_sum += weight * point["value"]
-        total_weight += weight
-
-    return (weighted_sum / total_weight) if total_weight > epsilon else sum(p["value"] for p in control_points) / len(control_points)
-
-# Gaussian Weighting
-def get_object_scale_gaussian(control_points, object_pos):
-    epsilon = 1e-8
-    sigma = 100
-    weighted_sum = 0.0
-    total_weight = 0.0
-
-    for point in control_points:
-        dist = distance(point["pos"], object_pos)
-        weight = math.exp(-((dist ** 2) / (2 * (sigma ** 2))))
-
-        weighted_sum += weight * point["value"]
-        total_weight += weight
-
-    return (weighted_sum / total_weight) if total_weight > epsilon else sum(p["value"] for p in control_points) / len(control_points)
-
-# Max-Nearby Influence
-def get_object_scale_max_nearby(control_points, object_pos, k=3):
-    epsilon = 1e-8
-    distances = [
-        (distance(point["pos"], object_pos), point["value"])
-        for point in control_points
-    ]
-    distances = sorted(distances, key=lambda x: x[0])[:k]
-
-    weighted_sum = 0.0
-    total_weight = 0.0
-
-    for dist, scale in distances:
-        weight = 1.0 / (dist + epsilon)
-        weighted_sum += weight * scale
-        total_weight += weight
-
-    return (weighted_sum / total_weight) if total_weight > epsilon else 0.0
-
-# Weighted Median
-def get_object_scale_weighted_median(control_points, object_pos):
-    epsilon = 1e-8
-    weighted_points = [
-        (point["value"], 1.0 / (distance(point["pos"], object_pos) + epsilon))
-        for point in control_points
-    ]
-    weighted_points = sorted(weighted_points, key=lambda x: x[0])
-
-    total_weight = sum(w for _, w in weighted_points)
-    cumulative_weight = 0.0
-
-    for scale, weight in weighted_points:
-        cumulative_weight += weight
-        if cumulative_weight >= total_weight / 2:
-            return scale
-
-    return sum(p["value"] for p in control_points) / len(control_points)
-
-# Harmonic Mean
-def get_object_scale_harmonic_mean(control_points, object_pos):
-    epsilon = 1e-8
-    weighted_inverse = 0.0
-    total_weight = 0.0
-
-    for point in control_points:
-        dist = distance(point["pos"], object_pos)
-        weight = 1.0 / (dist + epsilon)
-
-        weighted_inverse += weight / point["value"]
-        total_weight += weight
-
-    return (total_weight / weighted_inverse) if weighted_inverse > epsilon else sum(p["value"] for p in control_points) / len(control_points)
-
 # Prompt user for a scale value (simple implementation)
 def prompt_for_scale(defaultValue = DEFAULT_POINT_VALUE):
     running = True
@@ -241,23 +119,22 @@ def prompt_for_scale(defaultValue = DEFAULT_POINT_VALUE):
 
 # Handle mouse clicks
 def handle_mouse_click(event, control_points, new_scale):
+    nearest = control_points.grid.nearest(event.pos, 1)
+    clicked_index = nearest[0][1] if nearest and nearest[0][0] <= TOLERANCE_RADIUS else None
     if event.button == 1:  # Left click
         keys = pygame.key.get_pressed()
         shift_pressed = keys[pygame.K_LSHIFT] or keys[pygame.K_RSHIFT]
-        for point in control_points:
-            if distance(event.pos, point["pos"]) <= TOLERANCE_RADIUS:
-                control_points.remove(point)  # Remove point if near
-                return
+        if clicked_index is not None:
+            control_points.remove(clicked_index)  # Remove point if near
+            return
         # Otherwise, add a new point
-        control_points.append({"pos": event.pos, "value": random.randint(DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE) if shift_pressed else new_scale})
+        control_points.append(event.pos, random.randint(DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE) if shift_pressed else new_scale)
     elif event.button == 3:  # Right click
-        for point in control_points:
-            if distance(event.pos, point["pos"]) <= TOLERANCE_RADIUS:
-                new_scale = prompt_for_scale(point["value"])
-                if new_scale is not None:
-                    point["value"] = new_scale
-                    default_scale = new_scale
-                break
+        if clicked_index is not None:
+            new_scale = prompt_for_scale(int(control_points.value(clicked_index)))
+            if new_scale is not None:
+                control_points.set_value(clicked_index, new_scale)
+                default_scale = new_scale
 
 # Blends two integer RGB colors, using t as blend factor (0.0 .. 1.0)
 def blend_color(color1: tuple, color2: tuple, t: float) -> tuple:
@@ -285,217 +162,734 @@ def remap_value(value, mode):
     # Return unchanged value
     return value
 
-# Draws text with an outline for better visibility.
-def draw_outlined_text(surface, text, position, font, text_color, outline_color):
-    outline_offset = 1  # Thickness of the outline
+# Renders text with an outline into a new surface, which is 2 * outline_offset larger than the text.
+def render_outlined_text(text, font, antialias, text_color, outline_color, outline_offset=1):
+    outline_surface = font.render(text, antialias, outline_color)
+    width, height = outline_surface.get_size()
+    surface = pygame.Surface((width + 2 * outline_offset, height + 2 * outline_offset), pygame.SRCALPHA)
     for dx in [-outline_offset, 0, outline_offset]:
         for dy in [-outline_offset, 0, outline_offset]:
             if dx != 0 or dy != 0:
-                outline_surface = font.render(text, DRAW_ANTIALIASED, outline_color)
-                surface.blit(outline_surface, (position[0] + dx, position[1] + dy))
+                surface.blit(outline_surface, (outline_offset + dx, outline_offset + dy))
 
     # Draw the main text on top
-    text_surface = font.render(text, True, text_color)
-    surface.blit(text_surface, position)
-
-
-# Main loop
-clock = pygame.time.Clock()
-current_scale = DEFAULT_POINT_VALUE
-while True:
-    # Handle events
-    for event in pygame.event.get():
-        # Quit
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-        # Keyboard input
-        if event.type == pygame.KEYDOWN:
-            # Regenerate points
-            if event.key == pygame.K_SPACE:
-                control_points = [generate_random_point(WIDTH, HEIGHT, DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE) for _ in range(len(control_points))]
-            # Add random point
-            elif event.key == pygame.K_UP and len(control_points) < 100:
-                control_points.append(generate_random_point(WIDTH, HEIGHT, DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE))
-            # Remove point
-            elif event.key == pygame.K_DOWN and len(control_points) > 1:
-                control_points.pop()
-
-            # Cycle interpolation mode forward
-            elif event.key == pygame.K_y:
-                weighting_mode = (weighting_mode + 1) % len(weighting_modes)
-            # Cycle interpolation mode backward
-            elif event.key == pygame.K_x:
-                weighting_mode = (weighting_mode - 1) % len(weighting_modes)
-            # Cycle color remapping mode
-            elif event.key == pygame.K_c:
-                remapping_mode = (remapping_mode + 1) % 3
-
-            # Toggle antialiasing
-            elif event.key == pygame.K_a:
-                DRAW_ANTIALIASED = not DRAW_ANTIALIASED
-            # Toggle shading
-            elif event.key == pygame.K_s:
-                DRAW_SHADED = not DRAW_SHADED
-            # Toggle outlines
-            elif event.key == pygame.K_d:
-                DRAW_OUTLINES = not DRAW_OUTLINES
-            # Toggle value text
-            elif event.key == pygame.K_f:
-                DRAW_VALUE_TEXT = not DRAW_VALUE_TEXT
-
-            # Quit
-            elif event.key == pygame.K_q:
-                pygame.quit()
-                sys.exit()
-        # Mouse input
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            handle_mouse_click(event, control_points, current_scale if current_scale != 0 else DEFAULT_POINT_VALUE)
-
-    # Query mouse position
-    mouse_x, mouse_y = pygame.mouse.get_pos()
-    mouse_pos = (mouse_x, mouse_y)
-
-    # Compute radius based on control points and weighting mode
-    weighting_mode_text = weighting_modes[weighting_mode]
-    if weighting_mode == 0:
-        mouse_circle_radius = get_object_scale_linear(control_points, mouse_pos)
-    elif weighting_mode == 1:
-        mouse_circle_radius = get_object_scale_inverse_square(control_points, mouse_pos)
-    elif weighting_mode == 2:
-        mouse_circle_radius = get_object_scale_exponential(control_points, mouse_pos)
-    elif weighting_mode == 3:
-        mouse_circle_radius = get_object_scale_gaussian(control_points, mouse_pos)
-    elif weighting_mode == 4:
-        mouse_circle_radius = get_object_scale_max_nearby(control_points, mouse_pos)
-    elif weighting_mode == 5:
-        mouse_circle_radius = get_object_scale_weighted_median(control_points, mouse_pos)
-    elif weighting_mode == 6:
-        mouse_circle_radius = get_object_scale_harmonic_mean(control_points, mouse_pos)
-    current_scale = int(mouse_circle_radius)
-
-    # Clear screen
-    screen.fill(BACKGROUND)
-
-    # Compute minimum and maximum point value
-    if control_points:
-        min_point_value = min(point["value"] for point in control_points)
-        max_point_value = max(point["value"] for point in control_points)
-
-    # Sort by point value in ascending order
-    sorted_points = sorted(control_points, key=lambda p: p["value"])
-
-    # Find nearest control point
-    nearest_point_index = -1
-    nearest_point_distance = float('inf')
-    for i, point in enumerate(sorted_points):
-        dist = distance(point["pos"], mouse_pos)
-        if dist < nearest_point_distance:
-            nearest_point_distance = dist
-            nearest_point_index = i
-    if nearest_point_index > -1 and nearest_point_distance > TOLERANCE_RADIUS:
-        nearest_point_index = -1
+    surface.blit(font.render(text, True, text_color), (outline_offset, outline_offset))
+    return surface
+
+# LRU cache of rendered text surfaces, so unchanged strings are only rasterized once.
+# Keyed by font, text, antialiasing, color and outline color.
+class TextCache:
+    def __init__(self, max_size=TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the rendered text, with an outline if outline_color is given
+    def render(self, font, text, antialias, color, outline_color=None):
+        key = (font, text, antialias, color, outline_color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        if outline_color is None:
+            surface = font.render(text, antialias, color)
+        else:
+            surface = render_outlined_text(text, font, antialias, color, outline_color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_size:
+            self.surfaces.popitem(last=False)
+        return surface
 
-    # Control points draw pass 1: Normalize point value and draw control points filled radius
-    for point in sorted_points:
-        x, y = point["pos"]
-        size = point["value"]
+    def clear(self):
+        self.surfaces.clear()
 
-        if DRAW_SHADED:
-            # Normalize the value
-            if max_point_value > min_point_value:  # Avoid division by zero
-                normalized_value = (size - min_point_value) / (max_point_value - min_point_value)
-                normalized_value = remap_value(normalized_value, remapping_mode)
-            else:
-                normalized_value = 0.0
-
-            # Adjust brightness based on normalized value
-            radius_color = blend_color(BACKGROUND, CONTROLPOINT_RADIUS, map_01_to_range(normalized_value, 0.15, 1.0))
+text_cache = TextCache()
 
-            # Draw circle filled with adjusted brightness
-            if DRAW_ANTIALIASED:
-                pygame.gfxdraw.filled_circle(screen, x, y, size, radius_color)
-            else:
-                pygame.draw.circle(screen, radius_color, (x, y), size)
+# Draws text with an outline for better visibility.
+def draw_outlined_text(surface, text, position, font, text_color, outline_color):
+    outline_offset = 1  # Thickness of the outline
+    text_surface = text_cache.render(font, text, DRAW_ANTIALIASED, text_color, outline_color)
+    surface.blit(text_surface, (position[0] - outline_offset, position[1] - outline_offset))
+
+# Blends two integer RGB colors for an array of blend factors, returns an array of shape t.shape + (3,)
+def blend_colors(color1: tuple, color2: tuple, t: np.ndarray) -> np.ndarray:
+    color1 = np.asarray(color1, dtype=np.float64)
+    color2 = np.asarray(color2, dtype=np.float64)
+    blended = color1 + t[..., np.newaxis] * (color2 - color1)
+    return np.round(blended).astype(np.uint8)
+
+# Applies value remapping (or not) to an array of values.
+def remap_values(values: np.ndarray, mode: int) -> np.ndarray:
+    if mode == 1:
+        # Square values
+        return values * values
+    elif mode == 2:
+        # Root values
+        return np.sqrt(values)
+    # Return unchanged values
+    return values
+
+# Scale field of the whole screen, evaluated at HEATMAP_CELL_SIZE resolution and upscaled bilinearly
+heatmap_texture = ScaleLookupTexture(cell_size=HEATMAP_CELL_SIZE, error_samples=None)
+
+# Scales of all screen pixels, and the state they were computed from
+heatmap_scales = None
+heatmap_scales_key = None
+
+# Returns the (WIDTH, HEIGHT) array of scales of the heatmap, only computing it if points or weighting mode changed
+def get_scale_heatmap_scales(control_points, mode):
+    global heatmap_scales, heatmap_scales_key
+    key = (id(control_points), control_points.version, mode)
+    if key != heatmap_scales_key:
+        heatmap_scales = heatmap_texture.sample_grid(control_points, mode, np.arange(WIDTH), np.arange(HEIGHT))
+        heatmap_scales_key = key
+    return heatmap_scales
+
+# Renders the scale field of the whole screen as a color-mapped surface.
+# Uses the same color mapping as the shaded control points and mouse circle.
+def render_scale_heatmap(control_points, mode, remap_mode):
+    scales = get_scale_heatmap_scales(control_points, mode)
+
+    min_value = control_points.min_value
+    max_value = control_points.max_value
+    if max_value > min_value:  # Avoid division by zero
+        normalized = np.clip((scales - min_value) / (max_value - min_value), 0.0, 1.0)
+        normalized = remap_values(normalized, remap_mode)
+    else:
+        normalized = np.zeros_like(scales)
+
+    colors = blend_colors(BACKGROUND, CONTROLPOINT_RADIUS, map_01_to_range(normalized, 0.15, 1.0))
+    return pygame.surfarray.make_surface(colors)
+
+# Cached heatmap surface, and the state it was rendered from
+heatmap_surface = None
+heatmap_key = None
+
+# Returns the heatmap surface, only re-rendering it if points, weighting mode or remapping mode changed.
+# A changed remapping mode only recolors the cached scales.
+def get_scale_heatmap(control_points, mode, remap_mode):
+    global heatmap_surface, heatmap_key
+    key = (id(control_points), control_points.version, mode, remap_mode)
+    if key != heatmap_key:
+        heatmap_surface = render_scale_heatmap(control_points, mode, remap_mode)
+        heatmap_key = key
+    return heatmap_surface
+
+
+# Returns the color of a filled control point or mouse circle, from its value and the control point value range
+def get_value_color(value, min_point_value, max_point_value):
+    # Normalize the value
+    if max_point_value > min_point_value:  # Avoid division by zero
+        normalized_value = (value - min_point_value) / (max_point_value - min_point_value)
+        normalized_value = remap_value(normalized_value, remapping_mode)
+    else:
+        normalized_value = 0.0
+
+    # Adjust brightness based on normalized value
+    return blend_color(BACKGROUND, CONTROLPOINT_RADIUS, map_01_to_range(normalized_value, 0.15, 1.0))
+
+# Draws a filled control point circle with one draw call
+def fill_control_point_circle(surface, x, y, size, color):
+    if DRAW_ANTIALIASED:
+        pygame.gfxdraw.filled_circle(surface, x, y, size, color)
+    else:
+        pygame.draw.circle(surface, color, (x, y), size)
+
+# Control points draw pass 1: Normalize point value and draw control points filled radius
+def draw_control_points_pass1(surface, control_points):
+    if not DRAW_SHADED:
+        return
+    min_point_value = control_points.min_value
+    max_point_value = control_points.max_value
+    xs, ys, values = control_points.sorted_arrays
+    for px, py, value in zip(xs.tolist(), ys.tolist(), values.tolist()):
+        x, y = int(px), int(py)
+        size = int(value)
+
+        radius_color = get_value_color(size, min_point_value, max_point_value)
+
+        # Draw circle filled with adjusted brightness
+        fill_control_point_circle(surface, x, y, size, radius_color)
+
+# Pixel offsets (dx, dy) covered by a filled circle, by radius and antialiasing setting. Each disc is drawn
+# once by the same pygame function draw pass 1 uses, so the batched pass covers the same pixels.
+disc_offsets_cache = {}
+
+def disc_offsets(radius):
+    key = (radius, DRAW_ANTIALIASED)
+    offsets = disc_offsets_cache.get(key)
+    if offsets is None:
+        center = radius + 1
+        stamp = pygame.Surface((2 * center + 1, 2 * center + 1))
+        stamp.fill(BLACK)
+        fill_control_point_circle(stamp, center, center, radius, WHITE)
+        dx, dy = np.nonzero(pygame.surfarray.array_red(stamp))
+        offsets = (dx - center, dy - center)
+        disc_offsets_cache[key] = offsets
+    return offsets
+
+# Returns a mask of the discs that are completely covered by one of the largest discs drawn after them.
+# xs, ys and sizes must be sorted by ascending size, a disc can only be covered by a larger one. The
+# extra pixel of margin keeps rasterization differences from uncovering the edge of the hidden disc.
+def hidden_discs(xs, ys, sizes):
+    occluders = np.arange(max(0, len(sizes) - BATCHED_OCCLUDERS), len(sizes))
+    hidden = np.zeros(len(sizes), dtype=bool)
+    for chunk in batch_chunks(len(sizes), len(occluders)):
+        dx = xs[chunk, np.newaxis] - xs[occluders]
+        dy = ys[chunk, np.newaxis] - ys[occluders]
+        gap = sizes[occluders] - sizes[chunk, np.newaxis] - 1
+        hidden[chunk] = np.any((gap >= 0) & (dx * dx + dy * dy <= gap * gap), axis=1)
+    return hidden
+
+# Control points draw pass 1, batched: Points with the same integer value have the same radius and color, so
+# each group of small discs is painted into one pixel buffer with a single NumPy assignment of its disc offsets,
+# and the buffer is copied back to the surface once. Discs larger than BATCHED_MAX_RADIUS are still filled by
+# pygame, whose span fills beat scattering that many pixels, but those that a later disc paints over completely
+# are skipped. Falls back to draw_control_points_pass1() for surfaces without 32 bit pixels.
+def draw_control_points_pass1_batched(surface, control_points):
+    if not DRAW_SHADED or not control_points:
+        return
+    if surface.get_bitsize() != 32:
+        draw_control_points_pass1(surface, control_points)
+        return
+    min_point_value = control_points.min_value
+    max_point_value = control_points.max_value
+    xs, ys, values = control_points.sorted_arrays
+    xs = xs.astype(np.intp)
+    ys = ys.astype(np.intp)
+    sizes = values.astype(np.intp)
+    num_small = int(np.searchsorted(sizes, BATCHED_MAX_RADIUS, side="right"))
+
+    # Small discs, by group of equal size
+    if num_small > 0:
+        width, height = surface.get_size()
+        pixels = pygame.surfarray.pixels2d(surface)
+        buffer = np.ascontiguousarray(pixels.T) # Rows of the surface, for flat indexing
+        flat = buffer.ravel()
+        group_starts = np.concatenate(([0], np.flatnonzero(np.diff(sizes[:num_small])) + 1, [num_small]))
+        for start, end in zip(group_starts[:-1].tolist(), group_starts[1:].tolist()):
+            size = sizes[start].item()
+            radius_color = surface.map_rgb(get_value_color(size, min_point_value, max_point_value))
+            dx, dy = disc_offsets(size)
+            group_xs, group_ys = xs[start:end], ys[start:end]
+
+            # Discs within the surface are painted without clipping, at flat offsets from their center
+            interior = (group_xs > size) & (group_xs < width - size - 1) & (group_ys > size) & (group_ys < height - size - 1)
+            centers = group_ys[interior] * width + group_xs[interior]
+            offsets = dy * width + dx
+            for chunk in batch_chunks(len(centers), len(offsets)):
+                flat[(centers[chunk, np.newaxis] + offsets).ravel()] = radius_color
+
+            # Discs crossing the border
+            edge_xs, edge_ys = group_xs[~interior], group_ys[~interior]
+            for chunk in batch_chunks(len(edge_xs), len(dx)):
+                px = (edge_xs[chunk, np.newaxis] + dx).ravel()
+                py = (edge_ys[chunk, np.newaxis] + dy).ravel()
+                inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+                flat[py[inside] * width + px[inside]] = radius_color
+        pixels[...] = buffer.T
+        del pixels # Unlocks the surface
+
+    # Large discs, except hidden ones
+    xs, ys, sizes = xs[num_small:], ys[num_small:], sizes[num_small:]
+    visible = ~hidden_discs(xs, ys, sizes)
+    for x, y, size in zip(xs[visible].tolist(), ys[visible].tolist(), sizes[visible].tolist()):
+        fill_control_point_circle(surface, x, y, size, get_value_color(size, min_point_value, max_point_value))
+
+# Control points draw pass 2: Draw control points center, outline, and text
+def draw_control_points_pass2(surface, control_points):
+    xs, ys, values = control_points.sorted_arrays
+    for px, py, value in zip(xs.tolist(), ys.tolist(), values.tolist()):
+        x, y = int(px), int(py)
+        size = int(value)
 
-    # Prettier: Draw circle around mouse cursor (filled with adjusted brightness)
-    if sorted_points:
         if DRAW_SHADED:
-            # Normalize the radius to compute the color
-            if max_point_value > min_point_value:  # Avoid division by zero
-                normalized_mouse_value = (mouse_circle_radius - min_point_value) / (max_point_value - min_point_value)
-                normalized_mouse_value = remap_value(normalized_mouse_value, remapping_mode)
-            else:
-                normalized_mouse_value = 0.0
-
-            # Adjust brightness based on normalized value
-            mouse_color = blend_color(BACKGROUND, CONTROLPOINT_RADIUS, map_01_to_range(normalized_mouse_value, 0.15, 1.0))
-
-            # Draw the filled circle
-            if DRAW_ANTIALIASED:
-                pygame.gfxdraw.filled_circle(screen, mouse_x, mouse_y, int(mouse_circle_radius), mouse_color)
-            else:
-                pygame.draw.circle(screen, mouse_color, mouse_pos, int(mouse_circle_radius))
-
-            # Draw outline
+            # Draw circle outline
             if DRAW_OUTLINES:
                 if DRAW_ANTIALIASED:
-                    pygame.gfxdraw.aacircle(screen, mouse_x, mouse_y, int(mouse_circle_radius), BLACK) # Antialiased outline
+                    pygame.gfxdraw.aacircle(surface, x, y, size, BLACK) # Antialiased outline
                 else:
-                    pygame.draw.circle(screen, BLACK, mouse_pos, int(mouse_circle_radius), 1)
+                    pygame.draw.circle(surface, BLACK, (x, y), size, 1)
         else:
-            # Draw simple outline
+            # Draw simple circle outline
             if DRAW_ANTIALIASED:
-                pygame.gfxdraw.aacircle(screen, mouse_x, mouse_y, int(mouse_circle_radius), RESULT_RADIUS) # Antialiased outline
+                pygame.gfxdraw.aacircle(surface, x, y, size, CONTROLPOINT_RADIUS) # Antialiased outline
             else:
-                pygame.draw.circle(screen, RESULT_RADIUS, mouse_pos, int(mouse_circle_radius), 1)
-        pygame.draw.circle(screen, MOUSE_CENTER, (mouse_x, mouse_y), 2)
+                pygame.draw.circle(surface, CONTROLPOINT_RADIUS, (x, y), size, 1)
 
-    # Control points draw pass 2: Draw control points center, outline, and text
-    for point_index, point in enumerate(sorted_points):
-        x, y = point["pos"]
-        size = point["value"]
+        draw_control_point_center(surface, x, y, size)
 
-        if DRAW_SHADED:
-            # Draw circle outline
-            if DRAW_OUTLINES:
-                if DRAW_ANTIALIASED:
-                    pygame.gfxdraw.aacircle(screen, x, y, size, BLACK) # Antialiased outline
-                else:
-                    pygame.draw.circle(screen, BLACK, (x, y), size, 1)
-            if nearest_point_index == point_index:
-                pygame.draw.circle(screen, WHITE, (x, y), TOLERANCE_RADIUS)
+# Draws the center point and value text of a control point
+def draw_control_point_center(surface, x, y, size):
+    pygame.draw.circle(surface, CONTROLPOINT, (x, y), 2)
+    if DRAW_VALUE_TEXT:
+        surface.blit(text_cache.render(font, str(size), DRAW_ANTIALIASED, WHITE), (x + 5, y - 10))
+
+# Draws the highlight around the control point nearest to the mouse cursor
+def draw_nearest_point_highlight(surface, control_points, point_index):
+    x, y = (int(c) for c in control_points.pos(point_index))
+    size = int(control_points.value(point_index))
+    if DRAW_SHADED:
+        pygame.draw.circle(surface, WHITE, (x, y), TOLERANCE_RADIUS)
+    elif DRAW_ANTIALIASED:
+        pygame.gfxdraw.aacircle(surface, x, y, TOLERANCE_RADIUS, WHITE) # Antialiased outline
+    else:
+        pygame.draw.circle(surface, WHITE, (x, y), TOLERANCE_RADIUS, 1)
+    # The highlight is drawn on top of the point's center and text, draw them again
+    draw_control_point_center(surface, x, y, size)
+
+# Prettier: Draw circle around mouse cursor (filled with adjusted brightness)
+def draw_mouse_circle(surface, control_points, mouse_pos, mouse_circle_radius):
+    mouse_x, mouse_y = mouse_pos
+    if DRAW_SHADED:
+        # Adjust brightness based on normalized value
+        mouse_color = get_value_color(mouse_circle_radius, control_points.min_value, control_points.max_value)
+
+        # Draw the filled circle
+        if DRAW_ANTIALIASED:
+            pygame.gfxdraw.filled_circle(surface, mouse_x, mouse_y, int(mouse_circle_radius), mouse_color)
         else:
-            # Draw simple circle outline
+            pygame.draw.circle(surface, mouse_color, mouse_pos, int(mouse_circle_radius))
+
+        # Draw outline
+        if DRAW_OUTLINES:
             if DRAW_ANTIALIASED:
-                pygame.gfxdraw.aacircle(screen, x, y, size, CONTROLPOINT_RADIUS) # Antialiased outline
-                if nearest_point_index == point_index:
-                    pygame.gfxdraw.aacircle(screen, x, y, TOLERANCE_RADIUS, WHITE) # Antialiased outline            else:
-                pygame.draw.circle(screen, CONTROLPOINT_RADIUS, (x, y), size, 1)
-                if nearest_point_index == point_index:
-                    pygame.draw.circle(screen, WHITE, (x, y), TOLERANCE_RADIUS, 1)
-
-        # Draw center point
-        pygame.draw.circle(screen, CONTROLPOINT, (x, y), 2)
+                pygame.gfxdraw.aacircle(surface, mouse_x, mouse_y, int(mouse_circle_radius), BLACK) # Antialiased outline
+            else:
+                pygame.draw.circle(surface, BLACK, mouse_pos, int(mouse_circle_radius), 1)
+    else:
+        # Draw simple outline
+        if DRAW_ANTIALIASED:
+            pygame.gfxdraw.aacircle(surface, mouse_x, mouse_y, int(mouse_circle_radius), RESULT_RADIUS) # Antialiased outline
+        else:
+            pygame.draw.circle(surface, RESULT_RADIUS, mouse_pos, int(mouse_circle_radius), 1)
+    pygame.draw.circle(surface, MOUSE_CENTER, (mouse_x, mouse_y), 2)
+
+# Display top text
+def draw_top_text(surface, control_points):
+    draw_outlined_text(surface, f"Number of points: {len(control_points)}", (10, 10), font, GREY, BLACK)
+    draw_outlined_text(surface, f"Weighting mode: {weighting_modes[weighting_mode]}", (10, 30), font, GREY, BLACK)
+    draw_outlined_text(surface, f"Remapping mode: {remapping_modes[remapping_mode]}", (10, 50), font, GREY, BLACK)
+
+# Display bottom text
+def draw_help_text(surface):
+    draw_outlined_text(surface, "Help", (10, 610), font, GREY, BLACK)
+    draw_outlined_text(surface, "Display: A=Toggle antialiasing, S=Toggle shading, D=Toggle outlines, F=Toggle value text, H=Toggle heatmap, B=Toggle batched drawing, P=Toggle frame profiler, O=Export frame profile", (10, 630), font, GREY, BLACK)
+    draw_outlined_text(surface, "Interpolation: Y=Next weighting mode, X=Previous weighting mode, C=Cycle color remapping mode, T=Toggle truncated kernels, L=Toggle lookup texture, M=Toggle scale cache, N=Toggle approximation, R=Toggle temporal coherence", (10, 650), font, GREY, BLACK)
+    draw_outlined_text(surface, "Point management: SPACE=Regenerate points, UP=Add point, DOWN=Remove point, F5=Save points, F9=Load points", (10, 670), font, GREY, BLACK)
+    draw_outlined_text(surface, "                                        Left click: Add/Remove point (hold SHIFT to use random point value), Right click: Set point value", (10, 690), font, GREY, BLACK)
+
+# Frame profiler stages, in the order they run in a frame, and their colors in the overlay
+frame_profiler_stages = [
+    "events",
+    "scale eval",
+    "min/max/sort",
+    "pass1",
+    "mouse circle",
+    "pass2",
+    "text",
+    "flip"
+]
+frame_profiler_colors = [
+    (96, 96, 96),
+    (255, 64, 64),
+    (255, 160, 64),
+    (255, 255, 64),
+    (64, 255, 64),
+    (64, 255, 255),
+    (96, 128, 255),
+    (255, 96, 255)
+]
+
+# Measures how long each stage of a frame takes. Stages are timed by calling mark() at the end of each stage,
+# which adds the time since the previous mark to the stage. Disabled, all methods return immediately.
+# The last FRAME_PROFILER_HISTORY frames are kept in a ring buffer, for the overlay and for export.
+class FrameProfiler:
+    def __init__(self, history=FRAME_PROFILER_HISTORY):
+        self.enabled = False
+        self.stage_indices = {stage: i for i, stage in enumerate(frame_profiler_stages)}
+        self.frame_starts = np.zeros(history) # Seconds, perf_counter() time
+        self.stage_times = np.zeros((history, len(frame_profiler_stages))) # Seconds
+        self.num_frames = 0 # Number of frames recorded, including those that dropped out of the ring buffer
+        self.current = [0.0] * len(frame_profiler_stages)
+        self.frame_start = 0.0
+        self.last_time = 0.0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.begin_frame()
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.current = [0.0] * len(frame_profiler_stages)
+        self.frame_start = self.last_time = time.perf_counter()
+
+    # Ends the given stage
+    def mark(self, stage):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.current[self.stage_indices[stage]] += now - self.last_time
+        self.last_time = now
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        row = self.num_frames % len(self.stage_times)
+        self.frame_starts[row] = self.frame_start
+        self.stage_times[row] = self.current
+        self.num_frames += 1
+
+    # Returns frame start times and (frames, stages) stage times of the last count recorded frames, oldest first
+    def recent(self, count=None):
+        available = min(self.num_frames, len(self.stage_times))
+        count = available if count is None else min(count, available)
+        rows = np.arange(self.num_frames - count, self.num_frames) % len(self.stage_times)
+        return self.frame_starts[rows], self.stage_times[rows]
+
+    # Writes the recorded frames to a .csv file with one row per frame, or a .json file. Times are in milliseconds.
+    def export(self, path):
+        frame_starts, stage_times = self.recent()
+        frame_starts = (frame_starts - frame_starts[0]) * 1000.0 if len(frame_starts) else frame_starts
+        stage_times = stage_times * 1000.0
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump({
+                    "stages": frame_profiler_stages,
+                    "frames": [{"start": start, "stages": times} for start, times in zip(frame_starts.tolist(), stage_times.tolist())]
+                }, f, indent=2)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["start"] + frame_profiler_stages + ["total"])
+                for start, times in zip(frame_starts.tolist(), stage_times.tolist()):
+                    writer.writerow([f"{start:.3f}"] + [f"{t:.4f}" for t in times] + [f"{sum(times):.4f}"])
+
+    # Renders the overlay: a rolling stacked histogram of the last FRAME_PROFILER_GRAPH_FRAMES frames,
+    # with a line at the 60 fps frame budget, and the average frame time and average time of each stage
+    def render_overlay(self, font, bar_width=2, graph_height=80, budget_ms=1000.0 / 60.0):
+        graph_width = FRAME_PROFILER_GRAPH_FRAMES * bar_width
+        surface = pygame.Surface((graph_width + 580, graph_height), pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 160))
+
+        # Stage index at each pixel of each bar, len(stages) where the bar is empty
+        _, stage_times = self.recent(FRAME_PROFILER_GRAPH_FRAMES)
+        pixels_per_ms = graph_height / (2.0 * budget_ms)
+        tops = np.cumsum(stage_times * 1000.0 * pixels_per_ms, axis=1)
+        heights = np.arange(graph_height)[::-1] + 0.5
+        pixel_stages = (tops[:, np.newaxis, :] <= heights[np.newaxis, :, np.newaxis]).sum(axis=2)
+        palette = np.array(frame_profiler_colors + [(0, 0, 0)], dtype=np.uint8)
+        pixels = np.zeros((graph_width, graph_height, 3), dtype=np.uint8)
+        pixels[graph_width - len(pixel_stages) * bar_width:] = np.repeat(palette[pixel_stages], bar_width, axis=0)
+        surface.blit(pygame.surfarray.make_surface(pixels), (0, 0))
+        budget_y = graph_height - int(budget_ms * pixels_per_ms)
+        pygame.draw.line(surface, WHITE, (0, budget_y), (graph_width - 1, budget_y))
+
+        means = stage_times.mean(axis=0) * 1000.0 if len(stage_times) else np.zeros(len(frame_profiler_stages))
+        worst = stage_times.sum(axis=1).max() * 1000.0 if len(stage_times) else 0.0
+        labels = [(f"frame: {means.sum():.2f} ms", WHITE), (f"max: {worst:.2f} ms", WHITE)]
+        labels += [(f"{stage}: {mean:.2f} ms", color) for stage, mean, color in zip(frame_profiler_stages, means, frame_profiler_colors)]
+        for i, (label, color) in enumerate(labels):
+            position = (graph_width + 10 + (i // 4) * 190, 2 + (i % 4) * 20)
+            surface.blit(text_cache.render(font, label, DRAW_ANTIALIASED, color), position)
+        return surface
+
+frame_profiler = FrameProfiler()
+
+# Renders frames from two cached layers, which are only rebuilt when the control points or display settings change.
+# The base layer holds the background and draw pass 1, the transparent overlay layer holds draw pass 2 and the texts.
+# Everything that follows the mouse is drawn per frame, and only the screen areas it covered
+# in the previous and current frame are restored from the layers and updated.
+class Renderer:
+    def __init__(self, size):
+        self.screen_rect = pygame.Rect((0, 0), size)
+        self.base_layer = pygame.Surface(size)
+        self.overlay_layer = pygame.Surface(size, pygame.SRCALPHA)
+        self.key = None
+        self.previous_rect = None
+        self.full_redraw = True
+
+    # Forces the next frame to redraw and update the whole screen, e.g. after something else drew on it
+    def invalidate(self):
+        self.full_redraw = True
+
+    # Returns the state the cached layers depend on
+    def layer_key(self, control_points):
+        return (id(control_points), control_points.version, weighting_mode, remapping_mode,
+                DRAW_ANTIALIASED, DRAW_SHADED, DRAW_OUTLINES, DRAW_VALUE_TEXT, DRAW_HEATMAP, DRAW_BATCHED)
+
+    def rebuild_layers(self, control_points):
+        control_points.update_aggregates()
+        frame_profiler.mark("min/max/sort")
+
+        # Clear, or draw the scale field heatmap as background
+        if DRAW_HEATMAP and control_points:
+            self.base_layer.blit(get_scale_heatmap(control_points, weighting_mode, remapping_mode), (0, 0))
+        else:
+            self.base_layer.fill(BACKGROUND)
+        if DRAW_BATCHED:
+            draw_control_points_pass1_batched(self.base_layer, control_points)
+        else:
+            draw_control_points_pass1(self.base_layer, control_points)
+        frame_profiler.mark("pass1")
+
+        self.overlay_layer.fill((0, 0, 0, 0))
+        draw_control_points_pass2(self.overlay_layer, control_points)
+        frame_profiler.mark("pass2")
+        draw_top_text(self.overlay_layer, control_points)
+        draw_help_text(self.overlay_layer)
+        frame_profiler.mark("text")
+
+    # Merges overlapping rects, so the transparent overlay is not blended twice anywhere
+    @staticmethod
+    def merge_overlapping(rects):
+        merged = []
+        for rect in rects:
+            overlapping = rect.collidelistall(merged)
+            while overlapping:
+                rect = rect.unionall([merged[i] for i in overlapping])
+                merged = [other for i, other in enumerate(merged) if i not in overlapping]
+                overlapping = rect.collidelistall(merged)
+            merged.append(rect)
+        return merged
+
+    # Returns the screen area covered by the parts of a frame that follow the mouse
+    def dynamic_rect(self, control_points, mouse_pos, mouse_circle_radius, nearest_point_index, mouse_texts):
+        rects = []
+        if control_points:
+            radius = max(int(mouse_circle_radius), 2) + 1
+            rects.append(pygame.Rect(mouse_pos[0] - radius, mouse_pos[1] - radius, 2 * radius + 1, 2 * radius + 1))
+        if nearest_point_index > -1:
+            x, y = (int(c) for c in control_points.pos(nearest_point_index))
+            radius = TOLERANCE_RADIUS + 1
+            rects.append(pygame.Rect(x - radius, y - radius, 2 * radius + 1, 2 * radius + 1))
+            if DRAW_VALUE_TEXT:
+                label = text_cache.render(font, str(int(control_points.value(nearest_point_index))), DRAW_ANTIALIASED, WHITE)
+                rects.append(label.get_rect(topleft=(x + 5, y - 10)))
+        for surface, position in mouse_texts:
+            rects.append(surface.get_rect(topleft=position))
+        if not rects:
+            return pygame.Rect(mouse_pos, (0, 0))
+        return rects[0].unionall(rects[1:]).clip(self.screen_rect)
+
+    # Draws a frame, returns the list of screen rects to update, or None if the whole screen changed.
+    # If given, hud is a (surface, position) drawn on top of everything, e.g. the frame profiler overlay.
+    def draw(self, screen, control_points, mouse_pos, mouse_circle_radius, nearest_point_index, mouse_texts, hud=None):
+        key = self.layer_key(control_points)
+        if key != self.key:
+            self.rebuild_layers(control_points)
+            self.key = key
+            self.full_redraw = True
+
+        current_rect = self.dynamic_rect(control_points, mouse_pos, mouse_circle_radius, nearest_point_index, mouse_texts)
+        if self.full_redraw:
+            dirty_rects = [self.screen_rect]
+        else:
+            rects = [self.previous_rect, current_rect]
+            if hud is not None:
+                rects.append(hud[0].get_rect(topleft=hud[1]).clip(self.screen_rect))
+            dirty_rects = self.merge_overlapping(rects)
+
+        for rect in dirty_rects:
+            screen.blit(self.base_layer, rect, rect)
+        frame_profiler.mark("pass1")
+        if control_points:
+            draw_mouse_circle(screen, control_points, mouse_pos, mouse_circle_radius)
+        frame_profiler.mark("mouse circle")
+        for rect in dirty_rects:
+            screen.blit(self.overlay_layer, rect, rect)
+        if nearest_point_index > -1:
+            draw_nearest_point_highlight(screen, control_points, nearest_point_index)
+        frame_profiler.mark("pass2")
+        for surface, position in mouse_texts:
+            screen.blit(surface, position)
+        if hud is not None:
+            screen.blit(*hud)
+        frame_profiler.mark("text")
+
+        self.previous_rect = current_rect
+        if self.full_redraw:
+            self.full_redraw = False
+            return None
+        return dirty_rects
+
+# Opens the window and runs the interactive prototype
+def main():
+    global screen, font, control_points, weighting_mode, remapping_mode
+    global DRAW_ANTIALIASED, DRAW_SHADED, DRAW_OUTLINES, DRAW_VALUE_TEXT, DRAW_HEATMAP, DRAW_BATCHED, USE_TRUNCATED_KERNELS, USE_LOOKUP_TEXTURE, USE_SCALE_CACHE, USE_APPROXIMATION, USE_TEMPORAL_COHERENCE
+
+    # Initialize pygame
+    pygame.init()
+
+    # Initialize screen
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption(f"Weighted character scaling v2 - Prototype v{PROTOTYPE_VERSION}")
+
+    # Font setup
+    font = pygame.font.Font(None, FONT_SIZE)  # Default font, size 24
+
+    # Generate initial control points
+    control_points = ControlPointSet(generate_random_point(WIDTH, HEIGHT, DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE) for _ in range(INITIAL_NUM_POINTS))
+
+    # Main loop
+    lookup_texture = ScaleLookupTexture()
+    renderer = Renderer((WIDTH, HEIGHT))
+    scale_cache = ScaleCache()
+    coherent_query = CoherentQuery()
+    clock = pygame.time.Clock()
+    current_scale = DEFAULT_POINT_VALUE
+    while True:
+        frame_profiler.begin_frame()
+
+        # Handle events
+        for event in pygame.event.get():
+            # Quit
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            # Keyboard input
+            if event.type == pygame.KEYDOWN:
+                # Regenerate points
+                if event.key == pygame.K_SPACE:
+                    control_points.assign(generate_random_point(WIDTH, HEIGHT, DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE) for _ in range(len(control_points)))
+                # Add random point
+                elif event.key == pygame.K_UP and len(control_points) < 100:
+                    control_points.append(*generate_random_point(WIDTH, HEIGHT, DEFAULT_POINT_MIN_VALUE, DEFAULT_POINT_MAX_VALUE))
+                # Remove point
+                elif event.key == pygame.K_DOWN and len(control_points) > 1:
+                    control_points.pop()
+
+                # Cycle interpolation mode forward
+                elif event.key == pygame.K_y:
+                    weighting_mode = (weighting_mode + 1) % len(weighting_modes)
+                # Cycle interpolation mode backward
+                elif event.key == pygame.K_x:
+                    weighting_mode = (weighting_mode - 1) % len(weighting_modes)
+                # Cycle color remapping mode
+                elif event.key == pygame.K_c:
+                    remapping_mode = (remapping_mode + 1) % 3
+                # Toggle truncated kernels
+                elif event.key == pygame.K_t:
+                    USE_TRUNCATED_KERNELS = not USE_TRUNCATED_KERNELS
+                # Toggle baked lookup texture
+                elif event.key == pygame.K_l:
+                    USE_LOOKUP_TEXTURE = not USE_LOOKUP_TEXTURE
+                # Toggle scale cache
+                elif event.key == pygame.K_m:
+                    USE_SCALE_CACHE = not USE_SCALE_CACHE
+                # Toggle Barnes-Hut approximation
+                elif event.key == pygame.K_n:
+                    USE_APPROXIMATION = not USE_APPROXIMATION
+                # Toggle temporal coherence
+                elif event.key == pygame.K_r:
+                    USE_TEMPORAL_COHERENCE = not USE_TEMPORAL_COHERENCE
+
+                # Toggle antialiasing
+                elif event.key == pygame.K_a:
+                    DRAW_ANTIALIASED = not DRAW_ANTIALIASED
+                # Toggle shading
+                elif event.key == pygame.K_s:
+                    DRAW_SHADED = not DRAW_SHADED
+                # Toggle outlines
+                elif event.key == pygame.K_d:
+                    DRAW_OUTLINES = not DRAW_OUTLINES
+                # Toggle value text
+                elif event.key == pygame.K_f:
+                    DRAW_VALUE_TEXT = not DRAW_VALUE_TEXT
+                # Toggle scale field heatmap
+                elif event.key == pygame.K_h:
+                    DRAW_HEATMAP = not DRAW_HEATMAP
+                # Toggle batched drawing
+                elif event.key == pygame.K_b:
+                    DRAW_BATCHED = not DRAW_BATCHED
+                # Toggle frame profiler
+                elif event.key == pygame.K_p:
+                    frame_profiler.toggle()
+                    renderer.invalidate()
+                # Export frame profile
+                elif event.key == pygame.K_o:
+                    frame_profiler.export(FRAME_PROFILER_TRACE_PATH)
+                # Save points
+                elif event.key == pygame.K_F5:
+                    save_point_set(POINT_SET_PATH, control_points)
+                # Load points
+                elif event.key == pygame.K_F9:
+                    try:
+                        load_point_set(POINT_SET_PATH, control_points)
+                    except (OSError, ValueError) as e:
+                        print(f"Could not load points: {e}", file=sys.stderr)
+
+                # Quit
+                elif event.key == pygame.K_q:
+                    pygame.quit()
+                    sys.exit()
+            # Mouse input
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                handle_mouse_click(event, control_points, current_scale if current_scale != 0 else DEFAULT_POINT_VALUE)
+                renderer.invalidate() # The value prompt draws directly on the screen
+        frame_profiler.mark("events")
+
+        # Query mouse position
+        mouse_x, mouse_y = pygame.mouse.get_pos()
+        mouse_pos = (mouse_x, mouse_y)
+
+        # Compute radius based on control points and weighting mode
+        weighting_mode_text = weighting_modes[weighting_mode]
+        scale_error = None
+        scale_error_label = "error <=" # The truncated evaluations return a bound, the lookup texture a measurement
+        if USE_LOOKUP_TEXTURE:
+            mouse_circle_radius = lookup_texture.sample(control_points, weighting_mode, mouse_pos)
+            scale_error = lookup_texture.max_error
+            scale_error_label = "measured max error"
+        elif USE_TEMPORAL_COHERENCE and (weighting_mode == 4 or (USE_TRUNCATED_KERNELS and weighting_mode in COHERENT_MODES)):
+            mouse_circle_radius, scale_error = coherent_query.get(control_points, mouse_pos, weighting_mode)
+        elif USE_TRUNCATED_KERNELS and weighting_mode == 2:
+            mouse_circle_radius, scale_error = get_object_scale_exponential_truncated(control_points, mouse_pos)
+        elif USE_TRUNCATED_KERNELS and weighting_mode == 3:
+            mouse_circle_radius, scale_error = get_object_scale_gaussian_truncated(control_points, mouse_pos)
+        elif USE_APPROXIMATION and weighting_mode in APPROX_MODES:
+            mouse_circle_radius = get_object_scale_approx(control_points, mouse_pos, weighting_mode)
+        elif USE_SCALE_CACHE:
+            mouse_circle_radius = scale_cache.get(control_points, mouse_pos, weighting_mode)
+        else:
+            mouse_circle_radius = get_object_scale(control_points, mouse_pos, weighting_mode)
+        current_scale = int(mouse_circle_radius)
+
+        # Find nearest control point
+        nearest_point_index = -1
+        nearest = control_points.grid.nearest(mouse_pos, 1)
+        if nearest and nearest[0][0] <= TOLERANCE_RADIUS:
+            nearest_point_index = nearest[0][1]
+
+        # Text at mouse cursor
+        mouse_texts = []
         if DRAW_VALUE_TEXT:
-            screen.blit(font.render(str(size), DRAW_ANTIALIASED, WHITE), (x + 5, y - 10))
+            scale_text = f"Scale: {mouse_circle_radius:.2f}" if scale_error is None else f"Scale: {mouse_circle_radius:.2f} ({scale_error_label} {scale_error:.2g})"
+            mouse_texts.append((text_cache.render(font, scale_text, DRAW_ANTIALIASED, WHITE), (mouse_x + int(mouse_circle_radius) + 10, mouse_y - 10)))
+            mouse_texts.append((text_cache.render(font, weighting_mode_text, DRAW_ANTIALIASED, WHITE), (mouse_x + int(mouse_circle_radius) + 10, mouse_y + 10)))
+        frame_profiler.mark("scale eval")
+
+        # Frame profiler overlay, right of the top text
+        hud = None
+        if frame_profiler.enabled:
+            hud = (frame_profiler.render_overlay(font), (420, 10))
+            frame_profiler.mark("text")
+
+        # Draw the frame, and only update the screen areas that changed
+        dirty_rects = renderer.draw(screen, control_points, mouse_pos, mouse_circle_radius, nearest_point_index, mouse_texts, hud)
+        if dirty_rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty_rects)
+        frame_profiler.mark("flip")
+        frame_profiler.end_frame()
+        clock.tick(60)
 
-    # Display text at mouse cursor
-    if DRAW_VALUE_TEXT:
-        screen.blit(font.render(f"Scale: {mouse_circle_radius:.2f}", DRAW_ANTIALIASED, WHITE), (mouse_x + int(mouse_circle_radius) + 10, mouse_y - 10))
-        screen.blit(font.render(f"{weighting_mode_text}", DRAW_ANTIALIASED, WHITE), (mouse_x + int(mouse_circle_radius) + 10, mouse_y + 10))
-
-    # Display top text
-    draw_outlined_text(screen, f"Number of points: {len(control_points)}", (10, 10), font, GREY, BLACK)
-    draw_outlined_text(screen, f"Weighting mode: {weighting_mode_text}", (10, 30), font, GREY, BLACK)
-    draw_outlined_text(screen, f"Remapping mode: {remapping_modes[remapping_mode]}", (10, 50), font, GREY, BLACK)
-
-    # Display bottom text
-    draw_outlined_text(screen, "Help", (10, 610), font, GREY, BLACK)
-    draw_outlined_text(screen, "Display: A=Toggle antialiasing, S=Toggle shading, D=Toggle outlines, F=Toggle value text", (10, 630), font, GREY, BLACK)
-    draw_outlined_text(screen, "Interpolation: Y=Next weighting mode, X=Previous weighting mode, C=Cycle color remapping mode", (10, 650), font, GREY, BLACK)
-    draw_outlined_text(screen, "Point management: SPACE=Regenerate points, UP=Add point, DOWN=Remove point", (10, 670), font, GREY, BLACK)
-    draw_outlined_text(screen, "                                        Left click: Add/Remove point (hold SHIFT to use random point value), Right click: Set point value", (10, 690), font, GREY, BLACK)
-
-    pygame.display.flip()
-    clock.tick(60)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Checks that the fast evaluation paths in scalecore.py agree with the reference ones
+#
+# Positions and points are on integer coordinates of a small area, so distance ties are common.
+# Run with: python -m pytest
+
+import numpy as np
+import pytest
+
+import scalecore
+
+
+TOLERANCE = 1e-9
+AREA = (64, 48)
+
+# Creates a control point set with count random points on integer coordinates
+def make_control_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    control_points = scalecore.ControlPointSet()
+    control_points.assign_arrays(
+        rng.integers(0, AREA[0], count),
+        rng.integers(0, AREA[1], count),
+        rng.integers(scalecore.DEFAULT_POINT_MIN_VALUE, scalecore.DEFAULT_POINT_MAX_VALUE + 1, count))
+    return control_points
+
+# Returns an (N, 2) array of all integer positions in the area
+def area_positions(step=1):
+    grid_x, grid_y = np.meshgrid(np.arange(0, AREA[0], step), np.arange(0, AREA[1], step), indexing="ij")
+    return np.column_stack((grid_x.ravel(), grid_y.ravel())).astype(np.float64)
+
+@pytest.mark.parametrize("mode", range(len(scalecore.weighting_modes)))
+def test_batch_matches_scalar(mode):
+    control_points = make_control_points(40)
+    query_pos = area_positions(step=3)
+    batch = scalecore.get_object_scales(control_points, query_pos, mode)
+    scalar = [scalecore.get_object_scale(control_points, pos, mode) for pos in map(tuple, query_pos.tolist())]
+    np.testing.assert_allclose(batch, scalar, rtol=0, atol=TOLERANCE)
+
+@pytest.mark.parametrize("mode", scalecore.APPROX_MODES)
+def test_approximation_with_theta_zero_is_exact(mode):
+    control_points = make_control_points(500)
+    query_pos = area_positions(step=2)
+    exact = scalecore.get_object_scales(control_points, query_pos, mode)
+    approx = scalecore.get_object_scales_approx(control_points, query_pos, mode, theta=0.0)
+    np.testing.assert_allclose(approx, exact, rtol=TOLERANCE, atol=TOLERANCE)
+    pos = (10.0, 20.0)
+    assert scalecore.get_object_scale_approx(control_points, pos, mode, theta=0.0) == pytest.approx(scalecore.get_object_scale(control_points, pos, mode), abs=TOLERANCE)
+
+@pytest.mark.parametrize("mode", scalecore.COHERENT_MODES)
+def test_coherent_query_matches_full_evaluation(mode):
+    control_points = make_control_points(200)
+    if mode == 4:
+        def full(pos):
+            return scalecore.get_object_scale_max_nearby(control_points, pos)
+    elif mode == 2:
+        def full(pos):
+            return scalecore.get_object_scale_exponential_truncated(control_points, pos)[0]
+    else:
+        def full(pos):
+            return scalecore.get_object_scale_gaussian_truncated(control_points, pos)[0]
+
+    # A path of small steps, so most queries reuse the candidates of an earlier one
+    rng = np.random.default_rng(1)
+    path = np.clip(np.cumsum(rng.uniform(-2.0, 2.0, (300, 2)), axis=0) + (AREA[0] / 2, AREA[1] / 2), 0, AREA)
+    query = scalecore.CoherentQuery(margin=8)
+    for pos in map(tuple, path.tolist()):
+        assert query.get(control_points, pos, mode)[0] == pytest.approx(full(pos), abs=TOLERANCE)
+    assert query.hits > 0
+
+def test_max_nearby_breaks_ties_by_index():
+    # Four points at the same distance from the query, the two with the lowest indices are used
+    control_points = scalecore.ControlPointSet()
+    control_points.assign_arrays([10, 0, 20, 10], [0, 10, 10, 20], [40, 80, 120, 160])
+    pos = (10.0, 10.0)
+    expected = (40 + 80) / 2
+    assert scalecore.get_object_scale_max_nearby(control_points, pos, k=2) == pytest.approx(expected)
+    assert scalecore.get_object_scales_max_nearby(control_points.xs, control_points.ys, control_points.values, [pos], k=2)[0] == pytest.approx(expected)
+
+def test_point_set_survives_saving_over_its_own_file(tmp_path):
+    path = str(tmp_path / "points.cps")
+    control_points = make_control_points(100)
+    xs, ys, values = control_points.xs.copy(), control_points.ys.copy(), control_points.values.copy()
+    scalecore.save_point_set(path, control_points)
+    loaded = scalecore.load_point_set(path)
+    scalecore.save_point_set(path, loaded)
+    for resaved in (loaded, scalecore.load_point_set(path)):
+        np.testing.assert_array_equal(resaved.xs, xs)
+        np.testing.assert_array_equal(resaved.ys, ys)
+        np.testing.assert_array_equal(resaved.values, values)
+
+def test_point_set_writer_grow_keeps_loaded_sets(tmp_path):
+    path = str(tmp_path / "append.cps")
+    with scalecore.PointSetWriter(path, capacity=4) as writer:
+        for i in range(4):
+            writer.append((i, 10 + i), 20 + i)
+        loaded = scalecore.load_point_set(path)
+        for i in range(4, 10):
+            writer.append((i, 10 + i), 20 + i)
+        np.testing.assert_array_equal(loaded.ys, [10, 11, 12, 13])
+        np.testing.assert_array_equal(loaded.values, [20, 21, 22, 23])
+    reloaded = scalecore.load_point_set(path)
+    np.testing.assert_array_equal(reloaded.ys, np.arange(10, 20))
+    np.testing.assert_array_equal(reloaded.values, np.arange(20, 30))
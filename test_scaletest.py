@@ -0,0 +1,46 @@
+# Checks that the batched draw pass 1 of the pygame front end paints the same pixels as one draw call per point
+#
+# Run with: python -m pytest
+
+import os
+
+import numpy as np
+import pytest
+
+pygame = pytest.importorskip("pygame")
+
+import scalecore
+import scaletest
+
+
+@pytest.fixture(scope="module", autouse=True)
+def display():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    pygame.display.set_mode((scalecore.WIDTH, scalecore.HEIGHT))
+    yield
+    pygame.quit()
+
+# Draws pass 1 with the given function on a fresh surface, returns its pixels
+def draw_pass1(draw, control_points):
+    surface = pygame.Surface((scalecore.WIDTH, scalecore.HEIGHT))
+    surface.fill(scaletest.BACKGROUND)
+    draw(surface, control_points)
+    return pygame.surfarray.array2d(surface)
+
+@pytest.mark.parametrize("antialiased", [True, False])
+@pytest.mark.parametrize("remap_mode", range(len(scaletest.remapping_modes)))
+@pytest.mark.parametrize("count, min_value, max_value", [(1, 10, 10), (300, 2, 12), (300, 10, 150)])
+def test_batched_pass1_matches_per_call(monkeypatch, antialiased, remap_mode, count, min_value, max_value):
+    monkeypatch.setattr(scaletest, "DRAW_ANTIALIASED", antialiased)
+    monkeypatch.setattr(scaletest, "remapping_mode", remap_mode)
+    rng = np.random.default_rng(count)
+    control_points = scalecore.ControlPointSet()
+    # Some points beyond the screen edges, so clipped discs are covered too
+    control_points.assign_arrays(
+        rng.integers(-50, scalecore.WIDTH + 50, count),
+        rng.integers(-50, scalecore.HEIGHT + 50, count),
+        rng.integers(min_value, max_value + 1, count))
+    per_call = draw_pass1(scaletest.draw_control_points_pass1, control_points)
+    batched = draw_pass1(scaletest.draw_control_points_pass1_batched, control_points)
+    assert np.count_nonzero(per_call != batched) == 0
@@ -0,0 +1,131 @@
+# Offline baking of the scale field of large worlds
+#
+# Splits the world into tiles and evaluates them in a process pool. The control point arrays are
+# placed in shared memory once, instead of being pickled for every task, and each worker writes its
+# tiles straight into a memory-mapped .npy output file, laid out as (rows, columns). Example:
+#
+#   python tilebake.py --world 16384 16384 --points 1000 --mode 3 --output field.npy
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import scalecore
+
+
+DEFAULT_WORLD_SIZE = (16384, 16384)
+DEFAULT_TILE_SIZE = 512
+DEFAULT_NUM_POINTS = 1000
+
+# Control point arrays and output of the current worker process, set up by init_worker()
+worker_shared_memory = None
+worker_arrays = None
+worker_output = None
+
+# Returns whether mode is Weighted Median, which is evaluated on arrays sorted by value
+def is_weighted_median(mode):
+    return scalecore.batch_weighting_functions[mode] is scalecore.get_object_scales_weighted_median
+
+# Copies the control point arrays into a new shared memory block, in the order get_object_scales() evaluates
+# them for mode: sorted by value for Weighted Median, in index order for the others, because Max-Nearby
+# Influence breaks distance ties by index. Returns the block.
+def share_control_points(control_points, mode):
+    if is_weighted_median(mode):
+        xs, ys, values = control_points.sorted_arrays
+    else:
+        xs, ys, values = control_points.xs, control_points.ys, control_points.values
+    block = shared_memory.SharedMemory(create=True, size=max(1, 3 * len(values) * 8))
+    shared = np.ndarray((3, len(values)), dtype=np.float64, buffer=block.buf)
+    shared[0] = xs
+    shared[1] = ys
+    shared[2] = values
+    return block
+
+# Attaches the worker process to the shared control points and the output file
+def init_worker(shared_memory_name, num_points, output_path):
+    global worker_shared_memory, worker_arrays, worker_output
+    worker_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+    worker_arrays = np.ndarray((3, num_points), dtype=np.float64, buffer=worker_shared_memory.buf)
+    worker_output = np.load(output_path, mmap_mode="r+")
+
+# Evaluates one tile and writes it into the output file. Returns the number of samples.
+def bake_tile(mode, column, row, tile_width, tile_height):
+    xs, ys, values = worker_arrays
+    grid_x, grid_y = np.meshgrid(np.arange(column, column + tile_width), np.arange(row, row + tile_height))
+    query_pos = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+
+    function = scalecore.batch_weighting_functions[mode]
+    if is_weighted_median(mode):
+        scales = function(xs, ys, values, query_pos, presorted=True)
+    else:
+        scales = function(xs, ys, values, query_pos)
+
+    worker_output[row:row + tile_height, column:column + tile_width] = scales.reshape(tile_height, tile_width)
+    worker_output.flush()
+    return tile_width * tile_height
+
+# Returns (column, row, width, height) of all tiles covering the world
+def make_tiles(world_width, world_height, tile_size):
+    return [
+        (column, row, min(tile_size, world_width - column), min(tile_size, world_height - row))
+        for row in range(0, world_height, tile_size)
+        for column in range(0, world_width, tile_size)
+    ]
+
+# Bakes the scale field of a world_width x world_height world into a .npy file at output_path
+def bake(control_points, mode, world_width, world_height, output_path, tile_size=DEFAULT_TILE_SIZE, workers=None, dtype=np.float32, progress=None):
+    output = np.lib.format.open_memmap(output_path, mode="w+", dtype=dtype, shape=(world_height, world_width))
+    del output # Workers open the file themselves
+
+    block = share_control_points(control_points, mode)
+    try:
+        tiles = make_tiles(world_width, world_height, tile_size)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(block.name, len(control_points), output_path)) as executor:
+            futures = [executor.submit(bake_tile, mode, *tile) for tile in tiles]
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                if progress is not None:
+                    progress(done, len(tiles))
+    finally:
+        block.close()
+        block.unlink()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Bake the scale field of a large world into a .npy file")
+    parser.add_argument("--world", type=int, nargs=2, default=DEFAULT_WORLD_SIZE, metavar=("WIDTH", "HEIGHT"), help="world size in samples")
+    parser.add_argument("--points", type=int, default=DEFAULT_NUM_POINTS, help="number of random control points")
+    parser.add_argument("--mode", type=int, default=0, help="weighting mode index")
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE_SIZE, help="tile edge length in samples")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the control points")
+    parser.add_argument("--output", default="scale_field.npy", help="output .npy file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    world_width, world_height = args.world
+
+    rng = np.random.default_rng(args.seed)
+    control_points = scalecore.ControlPointSet()
+    control_points.assign_arrays(
+        rng.integers(0, world_width, args.points),
+        rng.integers(0, world_height, args.points),
+        rng.integers(scalecore.DEFAULT_POINT_MIN_VALUE, scalecore.DEFAULT_POINT_MAX_VALUE + 1, args.points))
+
+    def progress(done, total):
+        print(f"\r{done}/{total} tiles", end="", file=sys.stderr)
+
+    start = time.perf_counter()
+    bake(control_points, args.mode, world_width, world_height, args.output, args.tile, args.workers, progress=progress)
+    elapsed = time.perf_counter() - start
+    samples = world_width * world_height
+    print(f"\n{scalecore.weighting_modes[args.mode]}: {samples} samples with {args.workers} workers in {elapsed:.2f} s, {samples / elapsed:.0f} samples/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()